@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl  # one build per question across worker processes
+except ImportError:  # Windows
+    fcntl = None
+
+
+ARTIFACTS_DIR = os.environ.get("ARTIFACTS_DIR", "artifacts")
+
+
+def question_content_hash(question: Dict) -> str:
+    """Hash of the parts of a question that grading depends on (rubric + answer key)"""
+    payload = json.dumps(
+        {"rubric": question.get('rubric', ''), "answer": question.get('answer', '')},
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+@dataclass
+class QuestionArtifacts:
+    """
+    Everything about a question that does not depend on the student:
+    rubric analysis, the split answer key and its embeddings.
+    """
+    question_id: int
+    content_hash: str
+    max_points: int
+    num_parts: int
+    key_parts: List[str]
+    key_embeddings: np.ndarray
+    embedding_model: str
+    method: str = "llm"
+
+    def rubric_info(self) -> Dict:
+        """Same shape as RobustGrader._analyze_rubric_simple returns"""
+        return {"max_points": self.max_points, "num_parts": self.num_parts, "method": self.method}
+
+
+class ArtifactStore:
+    """
+    Per-question artifacts keyed by (question id, content hash), kept in memory and on disk.
+    Editing the rubric or answer of a question changes its hash, so stale artifacts are never used.
+    get_or_build runs at most one build per key at a time, across threads (a lock per key) and
+    worker processes (a lock file next to the artifacts). The others wait and use its result.
+    """
+
+    def __init__(self, directory: str = ARTIFACTS_DIR):
+        self.directory = directory
+        self._cache: Dict[tuple, QuestionArtifacts] = {}
+        self._lock = threading.Lock()
+        self._build_locks: Dict[tuple, threading.Lock] = {}
+
+    def _base_path(self, question_id, content_hash: str) -> str:
+        return os.path.join(self.directory, f"q{question_id}-{content_hash[:16]}")
+
+    def get(self, question: Dict, embedding_model: Optional[str] = None) -> Optional[QuestionArtifacts]:
+        """Return artifacts for this exact question content, from memory or disk, or None"""
+        key = (question.get('id'), question_content_hash(question))
+        artifacts = self._cache.get(key)
+        if artifacts is None:
+            artifacts = self._load(*key)
+            if artifacts is not None:
+                with self._lock:
+                    self._cache[key] = artifacts
+        if artifacts is not None and embedding_model and artifacts.embedding_model != embedding_model:
+            # built with another embedding model, its matrix can't be compared to ours
+            return None
+        return artifacts
+
+    def build(self, question: Dict, grader) -> Optional[QuestionArtifacts]:
+        """Run the student-independent grading steps once and persist the result"""
+        rubric = question.get('rubric', '')
+        answer_key = question.get('answer', '')
+        if not rubric or not answer_key:
+            print(f"⚠️ Question {question.get('id')} has no rubric or answer key, skipping artifacts")
+            return None
+
+        print(f"🛠️ Building artifacts for question {question.get('id')}")
+        rubric_info = grader._analyze_rubric_simple(rubric)
+        key_parts = grader._split_answer_key(answer_key, rubric_info["num_parts"])
+        if not key_parts:
+            print(f"❌ Could not split answer key of question {question.get('id')}, artifacts not saved")
+            return None
+
+        key_embeddings = np.asarray(grader._encode(key_parts), dtype=np.float32)
+        artifacts = QuestionArtifacts(
+            question_id=question.get('id'),
+            content_hash=question_content_hash(question),
+            max_points=rubric_info["max_points"],
+            num_parts=rubric_info["num_parts"],
+            key_parts=key_parts,
+            key_embeddings=key_embeddings,
+            embedding_model=grader.embedding_model_id,
+            method=rubric_info["method"],
+        )
+        if artifacts.method == "fallback":
+            # the rubric defaults were used because the LLM didn't answer, try again next time
+            print(f"⚠️ Rubric of question {question.get('id')} analyzed without the LLM, artifacts not saved")
+            return artifacts
+        self._save(artifacts)
+        with self._lock:
+            self._cache[(artifacts.question_id, artifacts.content_hash)] = artifacts
+        return artifacts
+
+    def invalidate(self, question_ids):
+        """Drop in-memory artifacts of questions that changed (on disk they are keyed by content hash)"""
+        with self._lock:
+            for key in [key for key in self._cache if key[0] in question_ids]:
+                del self._cache[key]
+
+    def get_or_build(self, question: Dict, grader) -> Optional[QuestionArtifacts]:
+        artifacts = self.get(question, grader.embedding_model_id)
+        if artifacts is not None:
+            return artifacts
+
+        key = (question.get('id'), question_content_hash(question))
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        with build_lock, self._file_lock(*key):
+            # built by another thread or worker while we waited
+            artifacts = self.get(question, grader.embedding_model_id)
+            if artifacts is None:
+                artifacts = self.build(question, grader)
+        return artifacts
+
+    @contextmanager
+    def _file_lock(self, question_id, content_hash: str) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._base_path(question_id, content_hash) + ".lock", 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _save(self, artifacts: QuestionArtifacts):
+        os.makedirs(self.directory, exist_ok=True)
+        base = self._base_path(artifacts.question_id, artifacts.content_hash)
+        meta = {
+            "question_id": artifacts.question_id,
+            "content_hash": artifacts.content_hash,
+            "max_points": artifacts.max_points,
+            "num_parts": artifacts.num_parts,
+            "key_parts": artifacts.key_parts,
+            "embedding_model": artifacts.embedding_model,
+            "method": artifacts.method,
+        }
+        # write to temp files (unique per writer) and rename, so a reader never sees a half-written artifact
+        tmp = f"{base}.{os.getpid()}-{threading.get_ident()}"
+        with open(tmp + ".npy.tmp", 'wb') as f:
+            np.save(f, artifacts.key_embeddings)
+        with open(tmp + ".json.tmp", 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp + ".npy.tmp", base + ".npy")
+        os.replace(tmp + ".json.tmp", base + ".json")
+
+    def _load(self, question_id, content_hash: str) -> Optional[QuestionArtifacts]:
+        base = self._base_path(question_id, content_hash)
+        if not (os.path.exists(base + ".json") and os.path.exists(base + ".npy")):
+            return None
+        try:
+            with open(base + ".json", 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get("content_hash") != content_hash:
+                return None
+            key_embeddings = np.load(base + ".npy")
+            if len(key_embeddings) != len(meta["key_parts"]):
+                # .npy and .json of different builds, build again
+                print(f"⚠️ Artifacts {base} don't match their embeddings, ignoring them")
+                return None
+            return QuestionArtifacts(key_embeddings=key_embeddings, **meta)
+        except Exception as e:
+            print(f"⚠️ Failed to load artifacts {base}: {e}")
+            return None
+
+
+if __name__ == "__main__":
+    # Build artifacts for every question in course_work.json ahead of time
+    # usage: python artifacts.py
+    from grader import RobustGrader
+
+    with open('course_work.json', 'r', encoding='utf-8') as f:
+        questions = json.load(f)
+
+    store = ArtifactStore()
+    grader = RobustGrader()
+    for question in questions:
+        if store.get(question, grader.embedding_model_id) is None:
+            store.get_or_build(question, grader)
+        else:
+            print(f"✅ Question {question.get('id')} artifacts are up to date")
@@ -1,23 +1,201 @@
 # server.py
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
-from grader import RobustGrader
+from grader import RobustGrader, question_grading_mode
+from model_registry import default_registry, DEFAULT_EMBEDDING_MODEL
+from embedding_backends import embedding_model_id
+from artifacts import ArtifactStore
+from question_store import QuestionStore
+from embedding_cache import EmbeddingCache
+from llm_cache import LLMCache
+from jobs import JobStore, JobQueue, QueueFull
+from result_cache import LeaderGone, ResultCache, result_key
+from backend_health import latency_budget
+import metrics
+import contextvars
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Load course work data
-try:
-    with open('course_work.json', 'r', encoding='utf-8') as f:
-        course_data = json.load(f)
-    print("✅ Course work data loaded successfully")
-except Exception as e:
-    print(f"❌ Failed to load course work data: {e}")
-    course_data = []
+# Load course work data, indexed by id and reloaded when professor.php changes the file
+question_store = QuestionStore('course_work.json')
+print(f"✅ Course work data loaded successfully ({len(question_store)} questions)")
 
+# Precomputed per-question grading artifacts (rubric analysis, split answer key, key embeddings)
+artifact_store = ArtifactStore()
+question_store.on_change(artifact_store.invalidate)
 
+# Embeddings of answer parts, kept in memory (LRU) and on disk across restarts
+embedding_cache = EmbeddingCache(
+    embedding_model_id(DEFAULT_EMBEDDING_MODEL),
+    max_memory_bytes=int(os.environ.get("EMBEDDING_CACHE_MEMORY_MB", 64)) * 1024 * 1024
+)
 
+# Ollama responses for prompts that repeat (rubric analysis, answer splits), kept on disk
+llm_cache = LLMCache(max_bytes=int(os.environ.get("LLM_CACHE_MB", 256)) * 1024 * 1024)
+
+# One grading engine for the whole process, shared by all request threads
+grader = RobustGrader(model_registry=default_registry, embedding_cache=embedding_cache, llm_cache=llm_cache)
+
+# Finished /process responses for resubmitted answers, dropped when the question is edited
+result_cache = ResultCache(
+    max_entries=int(os.environ.get("RESULT_CACHE_ENTRIES", 10000)),
+    ttl=float(os.environ.get("RESULT_CACHE_TTL", 3600))
+)
+question_store.on_change(result_cache.invalidate)
+
+# Startup: the embedding model is loaded and artifacts for every question are built in the
+# background, so the server answers /healthz right away. /readyz says when it can grade.
+# BACKGROUND_WARMUP=0 loads the model before the import returns (serve.py does this before forking).
+BACKGROUND_WARMUP = os.environ.get("BACKGROUND_WARMUP", "1") == "1"
+readiness = {"model": False, "artifacts": False}
+
+
+def warmup_model():
+    """Load the embedding model once for the whole process and run a warmup encode"""
+    try:
+        default_registry.warmup(DEFAULT_EMBEDDING_MODEL, grader.device, grader.embedding_backend)
+        readiness["model"] = True
+    except Exception as e:
+        print(f"❌ Failed to warm up embedding model: {e}")
+
+
+def warmup_artifacts():
+    """Build (or load from disk) grading artifacts for every question, so first requests don't pay for it"""
+    built = 0
+    for question in question_store.all():
+        try:
+            if artifact_store.get_or_build(question, grader) is not None:
+                built += 1
+        except Exception as e:
+            print(f"⚠️ Failed to build artifacts for question {question.get('id')}: {e}")
+    readiness["artifacts"] = True
+    print(f"🔥 Artifacts ready for {built}/{len(question_store)} questions")
+
+
+def _warmup():
+    warmup_model()
+    warmup_artifacts()
+
+
+if BACKGROUND_WARMUP:
+    threading.Thread(target=_warmup, name="warmup", daemon=True).start()
+else:
+    warmup_model()
+
+# Total time one /process, /process/stream or job grading may spend waiting on the LLM.
+# LLM calls that don't fit are skipped and the answer is graded semantically (degraded).
+# 0 = no limit, the budget then only records whether an LLM call was skipped or failed
+REQUEST_BUDGET_SECONDS = float(os.environ.get("REQUEST_BUDGET_SECONDS", 60)) or float("inf")
+# the same for a whole /process/batch request
+BATCH_BUDGET_SECONDS = float(os.environ.get("BATCH_BUDGET_SECONDS", 600)) or float("inf")
+
+# /process/batch limits
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 500))
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", 4))
+
+# Admission control: at most MAX_IN_FLIGHT gradings per process. Requests over the limit
+# wait up to ADMISSION_WAIT seconds for a slot, then get 503 with Retry-After instead of queueing.
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", 8))
+ADMISSION_WAIT = float(os.environ.get("ADMISSION_WAIT", 0.5))
+RETRY_AFTER = int(os.environ.get("RETRY_AFTER", 5))
+GRADING_ENDPOINTS = {"process", "process_stream", "process_batch"}
+grading_slots = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+REJECTED = metrics.registry.counter(
+    "http_rejected_total", "Grading requests turned away with 503 because all slots were busy", ["route"])
+
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.before_request
+def _admit():
+    if request.endpoint not in GRADING_ENDPOINTS:
+        return None
+    if not grading_slots.acquire(timeout=ADMISSION_WAIT):
+        REJECTED.inc(route=request.url_rule.rule)
+        response = jsonify({
+            "response": "Server is busy grading other answers, please try again shortly",
+            "status": "error"
+        })
+        response.status_code = 503
+        response.headers["Retry-After"] = str(RETRY_AFTER)
+        return response
+    g.grading_slot = True
+    return None
+
+
+@app.teardown_request
+def _release(exc):
+    # runs when the view returns; /process/stream takes its slot off g and releases it when the stream closes
+    if g.pop('grading_slot', False):
+        grading_slots.release()
+
+
+@app.after_request
+def _record_request(response):
+    # for /process/stream this is the time to the first byte, not the end of the stream
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.HTTP_REQUESTS.inc(route=route, status=response.status_code)
+    if hasattr(g, 'request_start'):
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, route=route)
+    return response
+
+
+def _find_question(question_id):
+    return question_store.get(question_id)
+
+
+def _grade(question_id, question_data, student_answer):
+    """Score + feedback for one answer, as returned by /process. Resubmissions come from result_cache"""
+    def grade():
+        with latency_budget(REQUEST_BUDGET_SECONDS) as budget:
+            artifacts = artifact_store.get_or_build(question_data, grader)
+            grading_result = grader.grade_answer(
+                question_data['rubric'], question_data['answer'], student_answer, artifacts=artifacts,
+                mode=question_grading_mode(question_data))
+            feedback = grader._feedback(grading_result)
+        return {
+            "status": "success",
+            "question_id": question_id,
+            **grading_result.to_dict(),
+            "feedback": feedback,
+            "degraded": budget.degraded,
+        }
+
+    key = result_key(question_data, student_answer, (grader.model_name, grader.embedding_model_id))
+    # a degraded result (LLM skipped) is not kept, the next submission gets a full grading
+    return result_cache.get_or_compute(key, grade, cacheable=lambda response: not response["degraded"])
+
+
+def _run_job(question_id, student_answer):
+    question_data = _find_question(question_id)
+    if not question_data:
+        raise ValueError(f"Question ID {question_id} not found")
+    if not question_data.get('rubric') or not question_data.get('answer'):
+        raise ValueError("Missing rubric or answer key for this question")
+    result = _grade(question_id, question_data, student_answer)
+    print(f"✅ Grading job completed: {result['score']}/{result['max_score']}")
+    return result
+
+
+# Asynchronous grading: POST /jobs queues the answer, GET /jobs/<id> polls for the result.
+# Jobs are kept in SQLite, so queued and finished jobs survive a restart.
+job_queue = JobQueue(
+    JobStore(),
+    _run_job,
+    workers=int(os.environ.get("JOB_WORKERS", 4)),
+    max_depth=int(os.environ.get("JOB_QUEUE_DEPTH", 200)),
+    retention=float(os.environ.get("JOB_RETENTION_HOURS", 24)) * 3600
+)
+job_queue.recover()
 
 
 @app.route("/process", methods=["POST"])
@@ -39,11 +217,7 @@ def process():
 
         
         # Find the question data
-        question_data = None
-        for item in course_data:
-            if item.get('id') == question_id:
-                question_data = item
-                break
+        question_data = _find_question(question_id)
         
         if not question_data:
             return jsonify({
@@ -61,35 +235,9 @@ def process():
                 "status": "error"
             }), 500
         
-        # Initialize grader with the student answer and answer key
-        grader = RobustGrader(
-            student_answer=student_answer,
-            answer_key=answer_key
-        )
-        
-      
-
-        grading_result = grader.grade_answer(rubric, answer_key, student_answer)
-        
-        # Calculate final score
-        total_score = sum(grading_result) if isinstance(grading_result, list) else 0
-        max_possible = grader.max_points if hasattr(grader, 'max_points') else len(grading_result)
-        
-        # Generate feedback
-        feedback = grader._feedback(grading_result)
-        
-        # Prepare response
-        response_data = {
-            "status": "success",
-            "question_id": question_id,
-            "score": total_score,
-            "max_score": max_possible,
-            "detailed_scores": grading_result,
-            "feedback": feedback,
-            "incorrect_parts": getattr(grader, 'incorrect_parts', [])
-        }
+        response_data = _grade(question_id, question_data, student_answer)
         
-        print(f"✅ Grading completed: {total_score}/{max_possible}")
+        print(f"✅ Grading completed: {response_data['score']}/{response_data['max_score']}")
         return jsonify(response_data)
         
     except Exception as e:
@@ -99,6 +247,285 @@ def process():
             "status": "error"
         }), 500
 
+@app.route("/process/stream", methods=["POST"])
+def process_stream():
+    """
+    Same as /process, but streams the result as NDJSON (one JSON object per line):
+      {"type": "score", ...}      as soon as scoring is done
+      {"type": "feedback", "token": "..."}   for every feedback chunk from Ollama
+      {"type": "done", "feedback": "..."}    with the full feedback text
+    Errors after the stream started are sent as {"type": "error", "response": "..."}
+    Resubmissions are answered from result_cache with a score and a done line, and a request
+    identical to one still grading (here or on /process) waits for that one's result.
+    """
+    data = request.json
+    if not data or 'text' not in data:
+        return jsonify({"response": "No text received", "status": "error"}), 400
+
+    student_answer = data['text']
+    question_id = data.get('question_id', 1)
+    print(f"📝 Received student answer for question {question_id} (streaming)")
+
+    question_data = _find_question(question_id)
+    if not question_data:
+        return jsonify({
+            "response": f"Question ID {question_id} not found",
+            "status": "error"
+        }), 404
+
+    rubric = question_data.get('rubric', '')
+    answer_key = question_data.get('answer', '')
+    if not rubric or not answer_key:
+        return jsonify({
+            "response": "Missing rubric or answer key for this question",
+            "status": "error"
+        }), 500
+
+    def cached_lines(response):
+        yield json.dumps({"type": "score", **{k: v for k, v in response.items() if k != "feedback"}},
+                         ensure_ascii=False) + "\n"
+        yield json.dumps({"type": "done", "feedback": response["feedback"]}, ensure_ascii=False) + "\n"
+        print(f"✅ Grading completed: {response['score']}/{response['max_score']} (cached)")
+
+    def generate():
+        key = result_key(question_data, student_answer, (grader.model_name, grader.embedding_model_id))
+        cached, future, leader = result_cache.begin(key)
+        if cached is None and not leader:
+            # the same answer is grading right now, wait for its result
+            try:
+                cached = future.result()
+            except LeaderGone:
+                pass
+            except Exception as e:
+                yield json.dumps({"type": "error", "status": "error", "response": f"Grading error: {str(e)}"}) + "\n"
+                return
+        if cached is not None:
+            yield from cached_lines(cached)
+            return
+
+        finished = False
+        try:
+            with latency_budget(REQUEST_BUDGET_SECONDS) as budget:
+                artifacts = artifact_store.get_or_build(question_data, grader)
+                grading_result = grader.grade_answer(rubric, answer_key, student_answer, artifacts=artifacts,
+                                                     mode=question_grading_mode(question_data))
+
+            yield json.dumps({
+                "type": "score",
+                "status": "success",
+                "question_id": question_id,
+                **grading_result.to_dict(),
+                "degraded": budget.degraded,
+            }, ensure_ascii=False) + "\n"
+
+            feedback = []
+            # the feedback stream gets what is left of the budget
+            with latency_budget(max(budget.remaining(), 0.001)) as feedback_budget:
+                for token in grader._feedback_stream(grading_result):
+                    feedback.append(token)
+                    yield json.dumps({"type": "feedback", "token": token}, ensure_ascii=False) + "\n"
+
+            feedback = "".join(feedback).strip()
+            yield json.dumps({"type": "done", "feedback": feedback}, ensure_ascii=False) + "\n"
+            print(f"✅ Grading completed: {grading_result.total_score}/{grading_result.max_points}")
+
+            degraded = budget.degraded or feedback_budget.degraded
+            response = {
+                "status": "success",
+                "question_id": question_id,
+                **grading_result.to_dict(),
+                "feedback": feedback,
+                "degraded": degraded,
+            }
+            if leader:
+                # same shape as /process, so both routes share the cached result
+                result_cache.finish(key, future, response, cacheable=not degraded and bool(feedback))
+            finished = True
+        except Exception as e:
+            print(f"❌ Error during grading: {str(e)}")
+            if leader:
+                result_cache.abort(key, future, e)
+                finished = True
+            yield json.dumps({"type": "error", "status": "error", "response": f"Grading error: {str(e)}"}) + "\n"
+        finally:
+            if leader and not finished:
+                # the client closed the stream, waiters grade it themselves
+                result_cache.abort(key, future, LeaderGone())
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # teardown_request runs before the stream is sent: keep the slot until the response is
+    # closed (stream finished or client gone, even if generate() never started)
+    if g.pop('grading_slot', False):
+        response.call_on_close(grading_slots.release)
+    return response
+
+@app.route("/process/batch", methods=["POST"])
+def process_batch():
+    """
+    Grade many submissions in one request
+    Expected input: {"items": [{"text": "student answer", "question_id": 1}, ...]}
+    Returns {"status": "success", "results": [...]} with one /process style result per item, in input order.
+    Items that can't be graded get {"status": "error", "response": "..."} in their slot.
+    """
+    try:
+        data = request.json
+        items = data.get('items') if isinstance(data, dict) else None
+        if not items or not isinstance(items, list):
+            return jsonify({"response": "No items received", "status": "error"}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({
+                "response": f"Too many items ({len(items)}), the limit is {BATCH_MAX_ITEMS}",
+                "status": "error"
+            }), 413
+
+        print(f"📝 Received batch of {len(items)} student answers")
+
+        results = [None] * len(items)
+        submissions = []
+        positions = []
+        question_ids = []
+        # artifacts built here (rubric and answer key LLM calls) count against the budget too
+        with latency_budget(BATCH_BUDGET_SECONDS) as budget:
+            for index, item in enumerate(items):
+                if not isinstance(item, dict) or 'text' not in item:
+                    results[index] = {"status": "error", "response": "No text received"}
+                    continue
+                question_id = item.get('question_id', 1)
+                question_data = _find_question(question_id)
+                if not question_data:
+                    results[index] = {"status": "error", "question_id": question_id, "response": f"Question ID {question_id} not found"}
+                    continue
+                rubric = question_data.get('rubric', '')
+                answer_key = question_data.get('answer', '')
+                if not rubric or not answer_key:
+                    results[index] = {"status": "error", "question_id": question_id, "response": "Missing rubric or answer key for this question"}
+                    continue
+
+                artifacts = artifact_store.get_or_build(question_data, grader)
+                submissions.append((rubric, answer_key, item['text'], artifacts, question_grading_mode(question_data)))
+                positions.append(index)
+                question_ids.append(question_id)
+
+            grading_results = grader.grade_batch(submissions, max_workers=BATCH_LLM_CONCURRENCY)
+
+            # feedback is one LLM call per submission, run them concurrently with the same limit
+            # copy_context: every call runs under this request's budget
+            with ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY) as pool:
+                futures = [pool.submit(contextvars.copy_context().run, grader._feedback, grading_result)
+                           for grading_result in grading_results]
+                feedbacks = [future.result() for future in futures]
+
+        for index, question_id, grading_result, feedback in zip(positions, question_ids, grading_results, feedbacks):
+            results[index] = {
+                "status": "success",
+                "question_id": question_id,
+                **grading_result.to_dict(),
+                "feedback": feedback,
+                # per batch: one skipped or failed LLM call marks every result
+                "degraded": budget.degraded,
+            }
+
+        print(f"✅ Batch grading completed: {len(grading_results)}/{len(items)} graded")
+        return jsonify({"status": "success", "results": results})
+
+    except Exception as e:
+        print(f"❌ Error during batch grading: {str(e)}")
+        return jsonify({
+            "response": f"Grading error: {str(e)}",
+            "status": "error"
+        }), 500
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """
+    Queue a student answer for grading and return right away
+    Expected input: {"text": "student answer", "question_id": 1}
+    Returns 202 {"status": "success", "job_id": "...", "state": "queued"}, poll GET /jobs/<job_id> for the result.
+    """
+    try:
+        data = request.json
+        if not data or 'text' not in data:
+            return jsonify({"response": "No text received", "status": "error"}), 400
+
+        question_id = data.get('question_id', 1)
+        if not _find_question(question_id):
+            return jsonify({
+                "response": f"Question ID {question_id} not found",
+                "status": "error"
+            }), 404
+
+        try:
+            job = job_queue.submit(question_id, data['text'])
+        except QueueFull:
+            response = jsonify({
+                "response": "Too many answers waiting to be graded, please try again shortly",
+                "status": "error"
+            })
+            response.status_code = 503
+            response.headers["Retry-After"] = str(RETRY_AFTER)
+            return response
+
+        print(f"📝 Queued student answer for question {question_id} as job {job['id']}")
+        return jsonify({"status": "success", "job_id": job['id'], "state": job['status']}), 202
+    except Exception as e:
+        return jsonify({
+            "response": f"Job submit error: {str(e)}",
+            "status": "error"
+        }), 500
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """
+    State of a grading job: queued, running, done (with the /process result) or failed (with the error)
+    """
+    job = job_queue.store.get(job_id)
+    if not job:
+        return jsonify({"response": f"Job {job_id} not found", "status": "error"}), 404
+
+    response_data = {
+        "status": "success",
+        "job_id": job_id,
+        "question_id": job['question_id'],
+        "state": job['status'],
+    }
+    if job['status'] == 'done':
+        response_data["result"] = job['result']
+    elif job['status'] == 'failed':
+        response_data["error"] = job['error']
+    return jsonify(response_data)
+
+
+@app.route("/questions/<int:question_id>/artifacts", methods=["POST"])
+def build_artifacts(question_id):
+    """
+    Precompute grading artifacts for a question in the background.
+    Called by professor.php right after a question is added.
+    """
+    try:
+        # the question was most likely just added, don't wait for the next mtime check
+        question_store.refresh(force=True)
+        question_data = _find_question(question_id)
+        if not question_data:
+            return jsonify({
+                "response": f"Question ID {question_id} not found",
+                "status": "error"
+            }), 404
+
+        def _build():
+            try:
+                artifact_store.get_or_build(question_data, grader)
+            except Exception as e:
+                print(f"❌ Failed to build artifacts for question {question_id}: {e}")
+
+        threading.Thread(target=_build, daemon=True).start()
+        return jsonify({"status": "accepted", "question_id": question_id}), 202
+    except Exception as e:
+        return jsonify({
+            "response": f"Artifact build error: {str(e)}",
+            "status": "error"
+        }), 500
 
 
 # this must be llm hallucination, because nobody uses this endpoint. can be deleted after demo day.
@@ -109,7 +536,7 @@ def get_questions():
     """
     try:
         questions_info = []
-        for item in course_data:
+        for item in question_store.all():
             questions_info.append({
                 "id": item.get('id'),
                 "question": item.get('questions', ''),
@@ -127,6 +554,44 @@ def get_questions():
             "message": f"Failed to retrieve questions: {str(e)}"
         }), 500
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Prometheus metrics: per-stage timings, Ollama call latency and token counts, embedding batches
+    """
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+def _readiness_checks():
+    return {
+        "model": readiness["model"],
+        "questions": question_store.loaded,
+        "llm": grader.llm_reachable(),
+    }
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """
+    Liveness: the process is up and serving requests (nothing else is checked)
+    """
+    return jsonify({"status": "alive"})
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """
+    Readiness: embedding model loaded, questions indexed and LLM backend reachable.
+    503 until all three hold, so load balancers don't send answers to a node that can't grade them.
+    """
+    checks = _readiness_checks()
+    ready = all(checks.values())
+    return jsonify({
+        "status": "ready" if ready else "not ready",
+        "checks": checks,
+        "artifacts_warm": readiness["artifacts"]
+    }), 200 if ready else 503
+
+
 @app.route("/", methods=["GET"])
 def health_check():
     """
@@ -134,14 +599,26 @@ def health_check():
     """
     return jsonify({
         "status": "Flask server is running", 
-        "message": "Ready to process requests",
+        "message": "Ready to process requests" if readiness["model"] else "Warming up, see /readyz",
         "endpoints": {
             "/": "Health check",
+            "/healthz": "Liveness (process is up)",
+            "/readyz": "Readiness (model loaded, questions indexed, LLM reachable)",
             "/questions": "Get available questions",
-            "/process": "Grade student answers (POST)"
+            "/metrics": "Prometheus metrics",
+            "/process": "Grade student answers (POST)",
+            "/process/stream": "Grade student answers, streaming feedback as NDJSON (POST)",
+            "/process/batch": "Grade many student answers in one request (POST)",
+            "/jobs": "Queue a student answer for grading (POST)",
+            "/jobs/<id>": "Poll a grading job for its result",
+            "/questions/<id>/artifacts": "Precompute grading artifacts for a question (POST)"
         }
     })
 
 if __name__ == "__main__":
     print("Starting Flask server on http://localhost:5050")
-    app.run(host='localhost', port=5050, debug=True)
+    # the grader is thread-safe, so requests are served on concurrent threads
+    job_queue.start()
+    # no reloader: its parent process would import this module too, loading a second model,
+    # building artifacts and recovering + running the job queue next to the serving child
+    app.run(host='localhost', port=5050, debug=True, threaded=True, use_reloader=False)
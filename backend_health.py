@@ -0,0 +1,261 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+from metrics import registry
+
+# consecutive failed calls that open the breaker, and seconds it stays open before a trial call
+BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", 3))
+BREAKER_RESET_SECONDS = float(os.environ.get("LLM_BREAKER_RESET_SECONDS", 30))
+# adaptive timeout = p99 of recent successful calls x TIMEOUT_FACTOR, within [MIN, MAX]
+TIMEOUT_FACTOR = float(os.environ.get("LLM_TIMEOUT_FACTOR", 3))
+MIN_TIMEOUT = float(os.environ.get("LLM_MIN_TIMEOUT", 5))
+MAX_TIMEOUT = float(os.environ.get("LLM_MAX_TIMEOUT", 120))
+# successful calls per call site needed before the timeout adapts
+MIN_SAMPLES = 20
+# 4xx responses that still say the backend is struggling (timeout, overloaded), other 4xx are our fault
+CLIENT_ERRORS_COUNTED = (408, 429)
+
+BREAKER_STATE = registry.gauge(
+    "llm_breaker_state", "LLM circuit breaker state (0 closed, 1 half-open, 2 open)", ["backend"])
+BREAKER_REJECTED = registry.counter(
+    "llm_breaker_rejected_total", "LLM calls failed fast because the breaker was open or the budget was spent",
+    ["call_site", "reason"])
+LLM_TIMEOUT_SECONDS = registry.gauge(
+    "llm_timeout_seconds", "Current adaptive timeout per call site", ["call_site"])
+
+_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class BackendUnavailable(Exception):
+    """
+    The LLM call was not attempted: the breaker is open, the request's latency budget is spent,
+    or the client had no free slot for it before its timeout
+    """
+
+
+class LatencyBudget:
+    """Wall-clock allowance for everything one request does. degraded is set when a step was skipped"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+        self.degraded = False
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+
+_budget: contextvars.ContextVar[Optional[LatencyBudget]] = contextvars.ContextVar("latency_budget", default=None)
+
+
+@contextmanager
+def latency_budget(seconds: Optional[float]) -> Iterator[Optional[LatencyBudget]]:
+    """with latency_budget(60) as budget: every LLM call inside gets at most what is left of the 60 s"""
+    budget = LatencyBudget(seconds) if seconds else None
+    token = _budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _budget.reset(token)
+
+
+def current_budget() -> Optional[LatencyBudget]:
+    return _budget.get()
+
+
+def mark_degraded():
+    budget = _budget.get()
+    if budget is not None:
+        budget.degraded = True
+
+
+class BackendHealth:
+    """
+    Health of one LLM backend, shared by every grader and thread in the process.
+
+    Circuit breaker: after `failures` consecutive failed calls the breaker opens and calls fail
+    fast with BackendUnavailable. After reset_seconds one trial call is let through (half-open);
+    its success closes the breaker, its failure opens it again.
+
+    Adaptive timeouts: per call site, the p99 of recent successful call latencies times
+    factor, clamped to [min_timeout, max_timeout]. Until enough calls were seen, max_timeout.
+    """
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS,
+                 factor: float = TIMEOUT_FACTOR, min_timeout: float = MIN_TIMEOUT, max_timeout: float = MAX_TIMEOUT):
+        self.name = name
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.factor = factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        BREAKER_STATE.set(0, backend=name)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            print(f"{'🟢' if state == 'closed' else '🔴' if state == 'open' else '🟡'} LLM backend {self.name}: {self.state} -> {state}")
+        self.state = state
+        BREAKER_STATE.set(_STATE_VALUES[state], backend=self.name)
+
+    @property
+    def available(self) -> bool:
+        """False while the breaker is open and not yet due for a trial call"""
+        return self.state != "open" or time.monotonic() - self._opened_at >= self.reset_seconds
+
+    def allow(self) -> bool:
+        """Whether a call may go out now. In half-open state only one trial call at a time"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_seconds:
+                    return False
+                self._set_state("half_open")
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self, call_site: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(call_site, deque(maxlen=200)).append(seconds)
+            self._consecutive_failures = 0
+            self._trial_in_flight = False
+            self._set_state("closed")
+
+    def record_failure(self, call_site: str):
+        with self._lock:
+            self._consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self._consecutive_failures >= self.failures:
+                self._opened_at = time.monotonic()
+                self._set_state("open")
+
+    def release(self):
+        """A call ended without telling anything about the backend (e.g. the client went away)"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def timeout(self, call_site: str) -> float:
+        samples = self._latencies.get(call_site)
+        if not samples or len(samples) < MIN_SAMPLES:
+            timeout = self.max_timeout
+        else:
+            timeout = float(np.percentile(list(samples), 99)) * self.factor
+            timeout = min(self.max_timeout, max(self.min_timeout, timeout))
+        LLM_TIMEOUT_SECONDS.set(round(timeout, 3), call_site=call_site)
+        return timeout
+
+
+class GuardedLLMClient:
+    """
+    Wraps an LLM client (OllamaClient / LlamaCppClient interface) with a BackendHealth:
+    calls fail fast while the breaker is open or the request's latency budget is spent,
+    and every call gets min(requested timeout, adaptive timeout, budget left). The client
+    counts the wait for one of its slots against that timeout.
+    """
+
+    def __init__(self, client, health: BackendHealth):
+        self.client = client
+        self.health = health
+
+    def reset(self):
+        self.client.reset()
+
+    def tags(self, timeout: float = 5) -> Dict:
+        return self.client.tags(timeout=timeout)
+
+    def _timeout(self, call_site: str, requested: Optional[float]) -> Tuple[float, bool]:
+        """(timeout for the call, whether the request's budget is what set it)"""
+        timeout = self.health.timeout(call_site)
+        if requested is not None:
+            timeout = min(timeout, requested)
+        budget = current_budget()
+        if budget is not None:
+            remaining = budget.remaining()
+            if remaining <= 0:
+                BREAKER_REJECTED.inc(call_site=call_site, reason="budget")
+                mark_degraded()
+                raise BackendUnavailable(f"latency budget of {budget.seconds:.0f}s spent")
+            if remaining < timeout:
+                return remaining, True
+        return timeout, False
+
+    def _admit(self, call_site: str, requested: Optional[float]) -> Tuple[float, bool]:
+        timeout = self._timeout(call_site, requested)
+        if not self.health.allow():
+            BREAKER_REJECTED.inc(call_site=call_site, reason="breaker_open")
+            mark_degraded()
+            raise BackendUnavailable(f"LLM backend {self.health.name} is unavailable (circuit open)")
+        return timeout
+
+    def _failed(self, call_site: str, error: Exception, budget_limited: bool):
+        status = getattr(error, "status_code", None)
+        if isinstance(error, BackendUnavailable):
+            # never reached the backend (every slot busy until the deadline), the call is skipped
+            BREAKER_REJECTED.inc(call_site=call_site, reason="no_slot")
+            mark_degraded()
+            self.health.release()
+        elif budget_limited and "Timeout" in type(error).__name__:
+            # cut short by the request's budget, says nothing about the backend
+            mark_degraded()
+            self.health.release()
+        elif status is not None and 400 <= status < 500 and status not in CLIENT_ERRORS_COUNTED:
+            # our request was rejected (e.g. a `format` an old Ollama doesn't know), the backend is fine
+            self.health.release()
+        else:
+            self.health.record_failure(call_site)
+
+    def generate(self, model: str, prompt: str, options: Dict, call_site: str = "generic",
+                 timeout: Optional[float] = 30, **extra) -> Dict:
+        timeout, budget_limited = self._admit(call_site, timeout)
+        start = time.perf_counter()
+        try:
+            result = self.client.generate(model, prompt, options, call_site=call_site, timeout=timeout, **extra)
+        except Exception as e:
+            self._failed(call_site, e, budget_limited)
+            raise
+        self.health.record_success(call_site, time.perf_counter() - start)
+        return result
+
+    def generate_stream(self, model: str, prompt: str, options: Dict, call_site: str = "generic",
+                        timeout: Optional[float] = 30, **extra) -> Iterator[Dict]:
+        timeout, budget_limited = self._admit(call_site, timeout)
+        start = time.perf_counter()
+        try:
+            for chunk in self.client.generate_stream(model, prompt, options, call_site=call_site, timeout=timeout, **extra):
+                yield chunk
+        except GeneratorExit:
+            # the consumer stopped reading, not the backend's fault
+            self.health.release()
+            raise
+        except Exception as e:
+            self._failed(call_site, e, budget_limited)
+            raise
+        self.health.record_success(call_site, time.perf_counter() - start)
+
+
+_health: Dict[str, BackendHealth] = {}
+_health_lock = threading.Lock()
+
+
+def get_health(name: str) -> BackendHealth:
+    """One BackendHealth per LLM backend (Ollama URL or llama.cpp) per process"""
+    with _health_lock:
+        health = _health.get(name)
+        if health is None:
+            health = _health[name] = BackendHealth(name)
+        return health
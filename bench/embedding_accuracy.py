@@ -0,0 +1,124 @@
+"""
+Accuracy and speed check of an embedding backend against the fp32 PyTorch model.
+
+Splits every answer key and fixture answer in course_work.json into parts (ordinal
+segmenter only, no LLM), then for every (answer key, answer) pair compares the cosine
+similarity matrices of both backends and the scores _score_answers gives with its
+0.7 / 0.8 thresholds. Answers are also paired with other questions' keys, so the
+check covers non-matching parts too.
+
+usage:
+    python -m bench.embedding_accuracy                       # int8 vs fp32
+    python -m bench.embedding_accuracy --backend cpu --threads 4 --max-seq-length 128
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def split_parts(text: str):
+    from segmenter import segment_ordinals
+    for num_parts in range(2, 7):
+        parts = segment_ordinals(text, num_parts)
+        if parts:
+            return parts
+    return [text]
+
+
+def build_pairs(questions):
+    from bench.run import build_fixtures
+
+    fixtures = build_fixtures(questions)
+    keys = {question['id']: split_parts(question['answer']) for question in questions if question.get('answer')}
+    pairs = []
+    for fixture in fixtures:
+        student_parts = split_parts(fixture["text"])
+        for question_id, key_parts in keys.items():
+            kind = fixture["kind"] if question_id == fixture["question"]["id"] else "other-question"
+            pairs.append({"kind": kind, "key_parts": key_parts, "student_parts": student_parts})
+    return pairs
+
+
+def score(grader, pair):
+    key_parts, student_parts = pair["key_parts"], pair["student_parts"]
+    scores, _, _ = grader._score_answers(key_parts, student_parts, len(key_parts), len(key_parts))
+    return list(scores)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare an embedding backend with the fp32 model")
+    parser.add_argument("--questions", default="course_work.json")
+    parser.add_argument("--backend", default="int8", help="backend to check (cpu or int8)")
+    parser.add_argument("--threads", type=int, default=None, help="EMBEDDING_THREADS for the checked backend")
+    parser.add_argument("--max-seq-length", type=int, default=None, help="EMBEDDING_MAX_SEQ_LENGTH for the checked backend")
+    parser.add_argument("--json", dest="json_out", default=None, help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    # read by embedding_backends at import time
+    if args.threads is not None:
+        os.environ["EMBEDDING_THREADS"] = str(args.threads)
+    if args.max_seq_length is not None:
+        os.environ["EMBEDDING_MAX_SEQ_LENGTH"] = str(args.max_seq_length)
+
+    import contextlib
+    import io
+    from grader import RobustGrader
+
+    with open(args.questions, 'r', encoding='utf-8') as f:
+        questions = json.load(f)
+    pairs = build_pairs(questions)
+    texts = sorted({text for pair in pairs for text in pair["key_parts"] + pair["student_parts"]})
+    print(f"🧪 {len(pairs)} answer pairs, {len(texts)} distinct parts")
+
+    graders = {name: RobustGrader(embedding_backend=name) for name in ("torch", args.backend)}
+
+    timings = {}
+    for name, grader in graders.items():
+        grader._encode(texts)  # warmup
+        start = time.perf_counter()
+        grader._encode(texts)
+        timings[name] = time.perf_counter() - start
+
+    max_diff = 0.0
+    mismatches = []
+    for pair in pairs:
+        with contextlib.redirect_stdout(io.StringIO()):
+            matrices = [g._semantic_score_answers(pair["key_parts"], pair["student_parts"]) for g in graders.values()]
+            scores = [score(g, pair) for g in graders.values()]
+        max_diff = max(max_diff, float(np.max(np.abs(matrices[0] - matrices[1]))))
+        if scores[0] != scores[1]:
+            mismatches.append({"kind": pair["kind"], "fp32": scores[0], args.backend: scores[1],
+                               "student_parts": pair["student_parts"]})
+
+    report = {
+        "backend": args.backend,
+        "pairs": len(pairs),
+        "max_abs_similarity_diff": max_diff,
+        "score_mismatches": len(mismatches),
+        "encode_seconds": timings,
+        "speedup": timings["torch"] / timings[args.backend] if timings[args.backend] else None,
+        "mismatches": mismatches,
+    }
+
+    print(f"\n📊 {args.backend} vs fp32")
+    print(f"   max |cos sim difference|: {max_diff:.4f}")
+    print(f"   pairs scored differently: {len(mismatches)}/{len(pairs)}")
+    print(f"   encode {len(texts)} parts: fp32 {timings['torch']:.3f}s, {args.backend} {timings[args.backend]:.3f}s "
+          f"({report['speedup']:.2f}x)")
+    for mismatch in mismatches:
+        print(f"   ❌ {mismatch['kind']}: fp32 {mismatch['fp32']} vs {args.backend} {mismatch[args.backend]}")
+
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Local stand-in for the Ollama HTTP API, for benchmarks without a GPU.
+
+Implements /api/tags and /api/generate (streaming and non-streaming) with a configurable
+delay per call. Answers are canned but shaped like llama3's: "Points: X, Parts: Y" for the
+rubric prompt, a [{"pointN": ...}] array (or {"points": [...]} when the request sets `format`) for the split prompt,
+{"segments": [...], "feedback": [...]} for the single-pass grading prompt, and a short text otherwise.
+
+usage: python -m bench.fake_ollama --port 11500 --delay 0.5
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FEEDBACK_TEXT = "תשובה טובה, אך חסר הסבר לחלק מהתכונות. נסו לנמק כל תכונה בעזרת דוגמה מהטקסט."
+
+
+def _words(text: str) -> set:
+    return set(re.findall(r'\w+', text))
+
+
+def single_pass_response(prompt: str) -> str:
+    """Every answer key part gets the student sentences that share the most words with it"""
+    body = prompt.split("model answer parts:", 1)[1]
+    key_text, student = body.split("Student answer:", 1)
+    student = student.split("Remember:", 1)[0].strip()
+    key_parts = [m.group(1) for m in re.finditer(r'^\s*\d+\. (.*)$', key_text, re.MULTILINE)]
+    sentences = [s.strip() for s in re.split(r'(?<=[.!?])\s+', student) if s.strip()]
+
+    segments = [[] for _ in key_parts]
+    for sentence in sentences:
+        overlaps = [len(_words(sentence) & _words(part)) for part in key_parts]
+        if overlaps and max(overlaps) >= 2:
+            segments[overlaps.index(max(overlaps))].append(sentence)
+    segments = [" ".join(chosen) for chosen in segments]
+    feedback = ["" if segment else FEEDBACK_TEXT for segment in segments]
+    return json.dumps({"segments": segments, "feedback": feedback}, ensure_ascii=False)
+
+
+def canned_response(prompt: str, default_parts: int = 2, structured: bool = False) -> str:
+    """Pick an answer based on which grader prompt this looks like. structured: the request had a `format`"""
+    if "How many maximum points" in prompt:
+        return f"Points: {default_parts}, Parts: {default_parts}"
+
+    if "model answer parts:" in prompt and "Student answer:" in prompt:
+        return single_pass_response(prompt)
+
+    if "Text to process:" in prompt:
+        parts_match = re.search(r'THERE ARE (\d+) parts', prompt)
+        num_parts = int(parts_match.group(1)) if parts_match else default_parts
+        text = prompt.split("Text to process:", 1)[1].split("Remember:", 1)[0].strip()
+        # cut the text into num_parts runs of sentences
+        sentences = [s.strip() for s in re.split(r'(?<=[.!?])\s+', text) if s.strip()] or [text]
+        size = max(1, -(-len(sentences) // num_parts))
+        chunks = [" ".join(sentences[i:i + size]) for i in range(0, len(sentences), size)][:num_parts]
+        if structured:
+            return json.dumps({"points": chunks}, ensure_ascii=False)
+        return json.dumps([{f"point{i + 1}": chunk} for i, chunk in enumerate(chunks)], ensure_ascii=False)
+
+    return FEEDBACK_TEXT
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # like Go's net/http (Ollama), otherwise keep-alive clients hit the 40 ms delayed-ACK stall
+    disable_nagle_algorithm = True
+    delay = 0.0
+    token_delay = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": "llama3:8b", "model": "llama3:8b"}]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self._send_json({"error": "not found"}, status=404)
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        prompt = request.get("prompt", "")
+        text = canned_response(prompt, structured="format" in request)
+        time.sleep(self.delay)
+
+        # same accounting fields Ollama returns, with made-up but plausible numbers (durations in ns)
+        stats = {
+            "prompt_eval_count": len(prompt.split()),
+            "eval_count": len(text.split()),
+            "load_duration": 1_000_000,
+            "prompt_eval_duration": 1_000_000,
+            "eval_duration": int(self.delay * 1e9),
+            "total_duration": int(self.delay * 1e9),
+        }
+
+        if not request.get("stream", True):
+            self._send_json({"model": request.get("model"), "response": text, "done": True, **stats})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in re.findall(r'\S+\s*', text):
+            self._write_chunk({"model": request.get("model"), "response": token, "done": False})
+            time.sleep(self.token_delay)
+        self._write_chunk({"model": request.get("model"), "response": "", "done": True, **stats})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, payload):
+        line = (json.dumps(payload, ensure_ascii=False) + "\n").encode('utf-8')
+        self.wfile.write(f"{len(line):X}\r\n".encode() + line + b"\r\n")
+        self.wfile.flush()
+
+
+def start_fake_ollama(port: int = 0, delay: float = 0.0, token_delay: float = 0.0):
+    """Start the server in a background thread. Returns (server, base url)"""
+    handler = type("Handler", (FakeOllamaHandler,), {"delay": delay, "token_delay": token_delay})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Ollama server for benchmarks")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds per /api/generate call")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+    args = parser.parse_args()
+
+    server, url = start_fake_ollama(args.port, args.delay, args.token_delay)
+    print(f"🦙 Fake Ollama listening on {url} (delay {args.delay}s)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,280 @@
+"""
+Offline grading benchmark.
+
+Runs RobustGrader.grade_answer and the Flask /process route against a local fake Ollama
+(bench/fake_ollama.py), using the questions in course_work.json as fixtures, and prints
+p50/p95/p99 latency per grading stage plus end-to-end requests/second per concurrency level.
+It also grades every fixture in both grading modes (multi-call pipeline and single pass) and
+reports latency, LLM calls per submission and how often the two modes give the same score.
+
+usage:
+    python -m bench.run                              # fake Ollama, tiny embedder
+    python -m bench.run --llm-delay 1.5 --concurrency 1 4 16
+    python -m bench.run --embedding-model MPA/sambert  # real embedding model
+    python -m bench.run --ollama-url http://localhost:11434  # real Ollama
+    python -m bench.run --llm-backend llama_cpp              # in-process llama.cpp (LLAMA_CPP_MODEL_PATH)
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_ollama import start_fake_ollama
+from bench.tiny_embedder import TinyEmbedder
+
+STAGES = ["rubric", "split_student", "split_key", "semantic", "feedback"]
+
+
+class StageTimer:
+    """Thread-safe collection of latencies per stage name"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"n": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"n": len(samples), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def instrument(grader_cls, timer: StageTimer):
+    """Wrap the grader's stage methods so every call is timed"""
+
+    def wrap(method_name, stage_of):
+        method = getattr(grader_cls, method_name)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                timer.record(stage_of(self, args), time.perf_counter() - start)
+
+        setattr(grader_cls, method_name, wrapper)
+
+    wrap("_analyze_rubric_simple", lambda self, args: "rubric")
+    # the grader names its splits itself ("split_key" / "split_student")
+    wrap("_timed_split", lambda self, args: args[0])
+    wrap("_semantic_score_answers", lambda self, args: "semantic")
+    wrap("_feedback", lambda self, args: "feedback")
+
+
+def build_fixtures(questions: List[Dict]) -> List[Dict]:
+    """A full, a partial and an unstructured (no ordinal markers) answer per question"""
+    from segmenter import segment_ordinals, _ORDINAL_PATTERN, _NUMBER_PATTERN
+
+    fixtures = []
+    for question in questions:
+        answer = question.get('answer', '')
+        if not answer or not question.get('rubric'):
+            continue
+        parts = segment_ordinals(answer, 2) or segment_ordinals(answer, 3) or [answer]
+        unstructured = " ".join(_NUMBER_PATTERN.sub('', _ORDINAL_PATTERN.sub('', answer)).split())
+        for kind, text in (("full", answer), ("partial", parts[0]), ("unstructured", unstructured)):
+            fixtures.append({"question": question, "kind": kind, "text": text})
+    return fixtures
+
+
+def bench_stages(fixtures: List[Dict], iterations: int, timer: StageTimer, registry) -> Dict:
+    """Run every stage of grade_answer + _feedback without precomputed artifacts"""
+    from grader import RobustGrader
+
+    timer.reset()
+    totals = []
+    grader = RobustGrader(model_registry=registry)
+    for _ in range(iterations):
+        for fixture in fixtures:
+            question = fixture["question"]
+            start = time.perf_counter()
+            result = grader.grade_answer(question['rubric'], question['answer'], fixture["text"])
+            grader._feedback(result)
+            totals.append(time.perf_counter() - start)
+
+    report = {stage: percentiles(timer.samples.get(stage, [])) for stage in STAGES}
+    report["grade_answer+feedback"] = percentiles(totals)
+    return report
+
+
+def bench_modes(fixtures: List[Dict], iterations: int, registry) -> Dict:
+    """grade_answer + _feedback in each grading mode, with artifacts as in production, and score agreement"""
+    from artifacts import ArtifactStore
+    from grader import RobustGrader, GRADING_MODES
+
+    grader = RobustGrader(model_registry=registry)
+    store = ArtifactStore(directory=tempfile.mkdtemp(prefix="bench-mode-artifacts-"))
+    artifacts = {}
+    for fixture in fixtures:
+        question = fixture["question"]
+        if question['id'] not in artifacts:
+            artifacts[question['id']] = store.get_or_build(question, grader)
+
+    # count the LLM calls each submission makes
+    calls = [0]
+    generate = grader.llm.generate
+
+    def counted(*args, **kwargs):
+        calls[0] += 1
+        return generate(*args, **kwargs)
+
+    grader.llm.generate = counted
+
+    report = {}
+    scores = {}
+    for mode in GRADING_MODES:
+        totals = []
+        calls[0] = 0
+        for _ in range(iterations):
+            for index, fixture in enumerate(fixtures):
+                question = fixture["question"]
+                start = time.perf_counter()
+                result = grader.grade_answer(question['rubric'], question['answer'], fixture["text"],
+                                             artifacts=artifacts[question['id']], mode=mode)
+                grader._feedback(result)
+                totals.append(time.perf_counter() - start)
+                scores[(mode, index)] = result.total_score
+        report[mode] = {"llm_calls": calls[0] / max(len(totals), 1), **percentiles(totals)}
+
+    # the same score as the multi-call pipeline, per fixture kind
+    agreement = defaultdict(list)
+    for index, fixture in enumerate(fixtures):
+        agreement[fixture["kind"]].append(scores[("pipeline", index)] == scores[("single_pass", index)])
+    agreement["all"] = [same for kind_results in list(agreement.values()) for same in kind_results]
+    report["agreement"] = {kind: sum(results) / len(results) for kind, results in agreement.items()}
+    return report
+
+
+def bench_process(fixtures: List[Dict], concurrency_levels: List[int], requests_per_level: int) -> Dict:
+    """End-to-end /process throughput through the Flask app (with artifacts, as in production)"""
+    import backend
+
+    def one(i):
+        fixture = fixtures[i % len(fixtures)]
+        client = backend.app.test_client()
+        start = time.perf_counter()
+        response = client.post("/process", json={"text": fixture["text"], "question_id": fixture["question"]["id"]})
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            raise RuntimeError(f"/process returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        return elapsed
+
+    # first pass builds the artifacts, keep it out of the numbers
+    for i in range(len(fixtures)):
+        one(i)
+
+    report = {}
+    for level in concurrency_levels:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            latencies = list(pool.map(one, range(requests_per_level)))
+        wall = time.perf_counter() - start
+        report[level] = {"rps": requests_per_level / wall, **percentiles(latencies)}
+    return report
+
+
+def print_report(stages: Dict, modes: Dict, process: Dict):
+    print("\n📊 Per-stage latency (seconds)")
+    print(f"{'stage':<24}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for stage, row in stages.items():
+        print(f"{stage:<24}{row['n']:>6}{row['p50']:>10.4f}{row['p95']:>10.4f}{row['p99']:>10.4f}")
+
+    print("\n🎯 Grading modes (grade_answer + feedback, with artifacts)")
+    print(f"{'mode':<14}{'n':>6}{'LLM calls':>12}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for mode, row in modes.items():
+        if mode != "agreement":
+            print(f"{mode:<14}{row['n']:>6}{row['llm_calls']:>12.2f}{row['p50']:>10.4f}{row['p95']:>10.4f}{row['p99']:>10.4f}")
+    agreement = ", ".join(f"{kind} {share:.0%}" for kind, share in modes["agreement"].items())
+    print(f"   same score as the pipeline: {agreement}")
+
+    print("\n🚀 /process end-to-end")
+    print(f"{'concurrency':<14}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for level, row in process.items():
+        print(f"{level:<14}{row['rps']:>10.2f}{row['p50']:>10.4f}{row['p95']:>10.4f}{row['p99']:>10.4f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline grading benchmark")
+    parser.add_argument("--questions", default="course_work.json")
+    parser.add_argument("--ollama-url", default=None, help="use this Ollama instead of the local fake")
+    parser.add_argument("--llm-backend", default="ollama", choices=["ollama", "llama_cpp"],
+                        help="llama_cpp: in-process model from LLAMA_CPP_MODEL_PATH instead of (fake) Ollama")
+    parser.add_argument("--llm-delay", type=float, default=0.05, help="fake Ollama seconds per call")
+    parser.add_argument("--embedding-model", default="tiny", help="'tiny' for the hashing embedder, or a sentence-transformers model name")
+    parser.add_argument("--iterations", type=int, default=3, help="passes over the fixtures for the stage report")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=24, help="/process requests per concurrency level")
+    parser.add_argument("--caches", action="store_true", help="keep the result and LLM response caches on (repeated fixtures then hit them)")
+    parser.add_argument("--json", dest="json_out", default=None, help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    os.environ["LLM_BACKEND"] = args.llm_backend
+    if args.ollama_url or args.llm_backend == "llama_cpp":
+        ollama_url = args.ollama_url or os.environ.get("OLLAMA_URL", "http://localhost:11434")
+    else:
+        _, ollama_url = start_fake_ollama(delay=args.llm_delay)
+        print(f"🦙 Fake Ollama on {ollama_url} ({args.llm_delay}s per call)")
+    # must be set before grader is imported, it is read at import time
+    os.environ["OLLAMA_URL"] = ollama_url
+    # keep the bench's jobs, cached LLM responses and embeddings out of the real ones
+    # (the tiny embedder is registered under the real model's name, its vectors must not be reused)
+    os.environ["JOBS_DB"] = os.path.join(tempfile.mkdtemp(prefix="bench-jobs-"), "jobs.db")
+    os.environ["LLM_CACHE_DB"] = os.path.join(tempfile.mkdtemp(prefix="bench-llm-cache-"), "llm_cache.db")
+    os.environ["EMBEDDING_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench-embedding-cache-")
+    os.environ["ARTIFACTS_DIR"] = tempfile.mkdtemp(prefix="bench-artifacts-")
+    # load the model before backend's import returns, and build no artifacts in the background:
+    # warmup LLM calls would run while the stages are measured and be counted with them
+    os.environ["BACKGROUND_WARMUP"] = "0"
+    if not args.caches:
+        # the fixtures repeat, so measure grading and not cache lookups
+        os.environ["RESULT_CACHE_TTL"] = "0"
+        os.environ["LLM_CACHE_CALL_SITES"] = ""
+
+    from model_registry import default_registry, DEFAULT_EMBEDDING_MODEL
+    if args.embedding_model == "tiny":
+        default_registry.register(TinyEmbedder(), DEFAULT_EMBEDDING_MODEL)
+    elif args.embedding_model != DEFAULT_EMBEDDING_MODEL:
+        default_registry.register(default_registry.get(args.embedding_model), DEFAULT_EMBEDDING_MODEL)
+
+    import grader
+    import backend  # noqa: F401  loads the model now, not inside the first measured request
+    timer = StageTimer()
+    instrument(grader.RobustGrader, timer)
+
+    with open(args.questions, 'r', encoding='utf-8') as f:
+        fixtures = build_fixtures(json.load(f))
+    print(f"🧪 {len(fixtures)} fixtures")
+
+    stages = bench_stages(fixtures, args.iterations, timer, default_registry)
+    modes = bench_modes(fixtures, args.iterations, default_registry)
+    process = bench_process(fixtures, args.concurrency, args.requests)
+    print_report(stages, modes, process)
+
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump({"stages": stages, "modes": modes, "process": process}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import os
+from typing import List, Optional, Union
+
+import numpy as np
+
+# "torch": the SentenceTransformer as loaded (fp32, default threading)
+# "cpu":   fp32 on CPU with the thread count / sequence length / batching below
+# "int8":  same as "cpu", with the Linear layers dynamically quantized to int8
+EMBEDDING_BACKENDS = ("torch", "cpu", "int8")
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+# intra-op threads for torch, 0 keeps torch's default (one per core)
+EMBEDDING_THREADS = int(os.environ.get("EMBEDDING_THREADS", 0))
+EMBEDDING_MAX_SEQ_LENGTH = int(os.environ.get("EMBEDDING_MAX_SEQ_LENGTH", 256))
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 32))
+
+
+def embedding_model_id(model_name: str, backend: str = EMBEDDING_BACKEND) -> str:
+    """
+    Name for the vectors a model + backend produce. Quantized or truncated embeddings differ
+    from the fp32 ones, so caches and artifacts are kept apart per backend.
+    """
+    if backend == "torch":
+        return model_name
+    return f"{model_name}+{backend}-{EMBEDDING_MAX_SEQ_LENGTH}"
+
+
+class CpuEmbeddingBackend:
+    """
+    SentenceTransformer tuned for CPU-only serving.
+
+    quantize:       replace every nn.Linear with a dynamically quantized int8 one (weights
+                    int8, activations quantized on the fly), ~2-3x faster on CPU with a small
+                    loss of precision, see bench/embedding_accuracy.py
+    num_threads:    torch intra-op threads (process-wide setting)
+    max_seq_length: longer texts are truncated, attention cost grows with the square of it
+    batch_size:     texts are sorted by length before batching, so short answer parts
+                    are not padded to the length of the longest one
+    """
+
+    def __init__(self, model, quantize: bool = False, num_threads: int = EMBEDDING_THREADS,
+                 max_seq_length: int = EMBEDDING_MAX_SEQ_LENGTH, batch_size: int = EMBEDDING_BATCH_SIZE):
+        import torch
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        model.max_seq_length = max_seq_length
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        model.eval()
+        self.model = model
+        self.quantize = quantize
+        self.batch_size = batch_size
+        self.max_seq_length = max_seq_length
+        self._torch = torch
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: Optional[int] = None, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        batch_size = batch_size or self.batch_size
+
+        order = np.argsort([len(text) for text in sentences], kind="stable")
+        out = None
+        with self._torch.inference_mode():
+            for start in range(0, len(order), batch_size):
+                rows = order[start:start + batch_size]
+                vectors = self.model.encode([sentences[i] for i in rows], batch_size=len(rows),
+                                            convert_to_numpy=True, show_progress_bar=False)
+                if out is None:
+                    out = np.zeros((len(sentences), vectors.shape[1]), dtype=np.float32)
+                out[rows] = vectors
+        if out is None:
+            out = np.zeros((0, 0), dtype=np.float32)
+        return out[0] if single else out
+
+
+def load_embedding_model(model_name: str, device: Optional[str] = None, backend: str = EMBEDDING_BACKEND):
+    """Load model_name with the given backend. Anything returned has .encode(texts) like a SentenceTransformer"""
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {EMBEDDING_BACKENDS}")
+    if backend == "torch":
+        return SentenceTransformer(model_name, device=device)
+    # quantized kernels are CPU only
+    return CpuEmbeddingBackend(SentenceTransformer(model_name, device="cpu"), quantize=(backend == "int8"))
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from metrics import registry
+
+try:
+    import fcntl  # serializes appends when several worker processes share the cache dir
+except ImportError:  # Windows
+    fcntl = None
+
+
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", "embedding_cache")
+
+CACHE_LOOKUPS = registry.counter(
+    "embedding_cache_lookups_total", "Embedding cache lookups by the tier that answered", ["tier"])
+
+
+def normalize_text(text: str) -> str:
+    """Texts that differ only in unicode form or whitespace share one cache entry"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def text_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of text embeddings for one model.
+
+    memory: LRU of vectors, capped at max_memory_bytes
+    disk:   <directory>/<model>/vectors.f32 - float32 rows appended one after another, read through np.memmap
+            <directory>/<model>/index.tsv   - "key<TAB>row" lines, appended after the row is written
+    The disk tier survives restarts. Only the misses of a call are sent to the model, in one batch.
+    The first encode of a process checks the model's vector size against the disk tier and
+    starts the disk tier over when they differ (e.g. another model was saved under the same name).
+    """
+
+    def __init__(self, model_name: str, directory: str = EMBEDDING_CACHE_DIR,
+                 max_memory_bytes: int = 64 * 1024 * 1024, max_disk_entries: int = 1_000_000):
+        self.model_name = model_name
+        self.directory = os.path.join(directory, re.sub(r'[^\w.-]', '_', model_name))
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_bytes = 0
+        self._index: Dict[str, int] = {}
+        self._index_offset = 0
+        self._dim: Optional[int] = None
+        self._mmap: Optional[np.memmap] = None
+        self._meta: Optional[Dict] = None
+        # set once the model's vector size was compared with the disk tier
+        self._checked = False
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._vectors_path = os.path.join(self.directory, "vectors.f32")
+        self._index_path = os.path.join(self.directory, "index.tsv")
+        self._meta_path = os.path.join(self.directory, "meta.json")
+        self._open_disk()
+
+    def __len__(self):
+        return len(self._index)
+
+    def encode(self, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Embeddings for texts, in order. encode_fn is called once with the texts that were not cached"""
+        keys = [text_key(self.model_name, text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        missing: Dict[str, str] = {}
+
+        if texts and not self._checked:
+            # one text through the model: its size tells whether the vectors on disk are this model's
+            vector = np.asarray(encode_fn(texts[:1]), dtype=np.float32)[0]
+            with self._lock:
+                self._check_dim(int(vector.shape[0]))
+                self._put_memory(keys[0], vector)
+                self._put_disk(keys[0], vector)
+
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in found or key in missing:
+                    continue
+                vector = self._get_memory(key)
+                if vector is not None:
+                    CACHE_LOOKUPS.inc(tier="memory")
+                    found[key] = vector
+                    continue
+                vector = self._get_disk(key)
+                if vector is not None:
+                    CACHE_LOOKUPS.inc(tier="disk")
+                    self._put_memory(key, vector)
+                    found[key] = vector
+                    continue
+                missing[key] = text
+
+        if missing:
+            CACHE_LOOKUPS.inc(len(missing), tier="miss")
+            vectors = np.asarray(encode_fn(list(missing.values())), dtype=np.float32)
+            with self._lock:
+                for key, vector in zip(missing, vectors):
+                    self._put_memory(key, vector)
+                    self._put_disk(key, vector)
+                    found[key] = vector
+
+        if not texts:
+            return np.zeros((0, self._dim or 0), dtype=np.float32)
+        return np.stack([found[key] for key in keys])
+
+    # memory tier
+
+    def _get_memory(self, key: str) -> Optional[np.ndarray]:
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+        return vector
+
+    def _put_memory(self, key: str, vector: np.ndarray):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = vector
+        self._memory_bytes += vector.nbytes
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    # disk tier
+
+    def _read_meta(self) -> Optional[Dict]:
+        try:
+            with open(self._meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _open_disk(self):
+        """(Re)read the disk tier from the start"""
+        self._index = {}
+        self._index_offset = 0
+        self._mmap = None
+        self._meta = self._read_meta()
+        self._dim = self._meta["dim"] if self._meta else None
+        if self._meta:
+            self._sync_index()
+
+    def _check_dim(self, dim: int):
+        if self._checked:
+            return
+        if self._read_meta() != self._meta:
+            # another process started the disk tier over since it was opened here
+            self._open_disk()
+        if self._dim is not None and self._dim != dim:
+            print(f"⚠️ Embedding cache {self.directory} holds {self._dim}-dim vectors, "
+                  f"the model makes {dim}-dim ones: starting it over")
+            for path in (self._meta_path, self._index_path, self._vectors_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._open_disk()
+        self._checked = True
+
+    def _sync_index(self):
+        """Read index lines appended since the last sync (possibly by another process)"""
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, 'r', encoding='utf-8') as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # half-written line, pick it up next time
+                key, row = line.rstrip("\n").split("\t")
+                self._index[key] = int(row)
+                self._index_offset += len(line.encode('utf-8'))
+
+    def _rows_on_disk(self) -> int:
+        if not self._dim or not os.path.exists(self._vectors_path):
+            return 0
+        return os.path.getsize(self._vectors_path) // (self._dim * 4)
+
+    def _get_disk(self, key: str) -> Optional[np.ndarray]:
+        row = self._index.get(key)
+        if row is None:
+            self._sync_index()
+            row = self._index.get(key)
+            if row is None:
+                return None
+        if self._mmap is None or row >= self._mmap.shape[0]:
+            rows = self._rows_on_disk()
+            if row >= rows:
+                return None
+            self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(rows, self._dim))
+        return np.array(self._mmap[row])
+
+    def _put_disk(self, key: str, vector: np.ndarray):
+        if len(self._index) >= self.max_disk_entries:
+            return
+        if self._dim is None:
+            self._dim = int(vector.shape[0])
+            # created: tells other processes the disk tier was started over
+            self._meta = {"model": self.model_name, "dim": self._dim, "created": time.time()}
+            with open(self._meta_path, 'w', encoding='utf-8') as f:
+                json.dump(self._meta, f)
+        if vector.shape[0] != self._dim:
+            print(f"⚠️ Embedding size {vector.shape[0]} doesn't match cache ({self._dim}), not caching on disk")
+            return
+
+        try:
+            with open(self._vectors_path, 'ab') as vectors, open(self._index_path, 'a', encoding='utf-8') as index:
+                if fcntl:
+                    fcntl.flock(vectors, fcntl.LOCK_EX)
+                # the row is wherever the file ends now, other processes may have appended too
+                row = vectors.seek(0, os.SEEK_END) // (self._dim * 4)
+                vectors.write(vector.astype(np.float32).tobytes())
+                vectors.flush()
+                index.write(f"{key}\t{row}\n")
+                index.flush()
+            self._index[key] = row
+        except OSError as e:
+            print(f"⚠️ Failed to write embedding cache: {e}")
@@ -1,150 +1,490 @@
-import requests
-import json
+import contextvars
+import os
+import time
 import re
-from sentence_transformers import SentenceTransformer, util
-from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
+from model_registry import ModelRegistry, default_registry, DEFAULT_EMBEDDING_MODEL
+from embedding_backends import EMBEDDING_BACKEND, embedding_model_id
+from segmenter import segment_in_text, segment_ordinals, split_sentences
+from matching import PART_MATCHING, SINGLE_PART_THRESHOLD, match_parts, stack_similarities
+from metrics import span, record_encode, SPLIT_STRATEGY, SPLIT_PARSE, SINGLE_PASS
+from point_parser import parse_points, parse_graded_parts, POINTS_SCHEMA, GRADED_PARTS_SCHEMA
+from llm_client import OllamaClient, get_client
+from llm_cache import CachedLLMClient
+from backend_health import BackendUnavailable, GuardedLLMClient, get_health, mark_degraded
+
+
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+# generate calls in flight per Ollama server, per process
+OLLAMA_MAX_CONCURRENCY = int(os.environ.get("OLLAMA_MAX_CONCURRENCY", 4))
+# seconds before loading a failed embedding model is tried again
+MODEL_RETRY_SECONDS = 30
+# "ollama" (HTTP) or "llama_cpp" (in-process model, see llama_cpp_client.py)
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "ollama")
+# ask Ollama for schema-constrained JSON in answer splits (needs Ollama 0.5+), 0 for free text
+OLLAMA_STRUCTURED_SPLIT = os.environ.get("OLLAMA_STRUCTURED_SPLIT", "1") == "1"
+# per question "grading_mode" in course_work.json:
+# "pipeline":    split the student answer, score, then a separate feedback call
+# "single_pass": one LLM call returns the student text per answer key part plus feedback for the missed parts
+GRADING_MODES = ("pipeline", "single_pass")
+
+
+if OLLAMA_STRUCTURED_SPLIT:
+    _SPLIT_OUTPUT_FORMAT = """{
+            "points": [
+            "COMPLETE FULL TEXT of the first point including all words",
+            "COMPLETE FULL TEXT of the second point including all words",
+            "COMPLETE FULL TEXT of the third point including all words"
+            ... (one string per point)
+            ]
+            }"""
+else:
+    _SPLIT_OUTPUT_FORMAT = """[
+            {"point1": "COMPLETE FULL TEXT of the first point including all words"},
+            {"point2": "COMPLETE FULL TEXT of the second point including all words"},
+            {"point3": "COMPLETE FULL TEXT of the third point including all words"}
+            ... (increment point numbers: point1, point2, point3, etc. for each entry)
+            ]"""
 
-def fix_json_quotes(json_string):
-    """
-    General function to fix unescaped quotes in JSON string values.
-    This works by finding JSON string patterns and escaping internal quotes.
-    """
-    # Pattern to match JSON string values: "key": "value with possible "quotes" inside"
-    # This captures the key, colon, opening quote, content, and closing quote
-    pattern = r'("[\w\d]+"\s*:\s*")([^"]*(?:"[^"]*"[^"]*)*?)("\s*[,}])'
-    
-    def escape_internal_quotes(match):
-        prefix = match.group(1)  # "key": "
-        content = match.group(2)  # the content that may have unescaped quotes
-        suffix = match.group(3)   # " followed by , or }
-        
-        # Escape any quotes in the content
-        escaped_content = content.replace('"', '\\"')
-        
-        return prefix + escaped_content + suffix
-    
-    # Apply the fix
-    fixed_string = re.sub(pattern, escape_internal_quotes, json_string, flags=re.DOTALL)
-    
-    return fixed_string
+# Fixed instructions of the split prompt. Everything that changes per call (part count, text)
+# comes after them, so the LLM can keep the evaluated instructions in its KV cache between calls.
+SPLIT_INSTRUCTIONS = f"""CRITICAL: Return ONLY the JSON below, with NO additional text before or after. Do not add any explanations, headers, or other text.
+
+            Analyze the Hebrew text and extract points based on these rules:
+            - The expected number of points to extract is given below the rules
+            - If the text contains numbered ordinal markers (האחת, השנייה, השלישית, הרביעית, והאחרונה, etc.), extract each numbered point separately. according to the expected number of parts
+            - If the text does NOT contain numbered markers, treat the entire text as ONE single point
+            - IGNORE any introductory text, preamble, or general information that appears BEFORE the first numbered ordinal marker
+            - Only start extracting from the first numbered marker (האחת, השנייה, etc.) onwards
+
+            Return in this EXACT JSON format:
+            {_SPLIT_OUTPUT_FORMAT}
+
+            IMPORTANT: 
+            - Do NOT artificially split continuous text that lacks numbered markers
+            - Include the COMPLETE text for each point. Do not truncate or shorten anything
+            - CRITICAL: When numbered markers exist, IGNORE any text before the first marker and only extract from the numbered sections
+            - Only create multiple JSON entries when there are clear numbered divisions in the text
+            - Target the expected number of parts, but prioritize natural divisions over forced splitting
+            - For numbered content: each point should include the ordinal marker and all text until the next marker (or end)
+"""
+
+
+# Fixed instructions of the single-pass grading prompt, the answer key parts and the student answer come after them
+SINGLE_PASS_INSTRUCTIONS = """CRITICAL: Return ONLY the JSON below, with NO additional text before or after. Do not add any explanations, headers, or other text.
+
+            You get the numbered parts of a model answer and a student answer, both in Hebrew.
+            For every model answer part, in order:
+            - segments: copy the COMPLETE text of the student answer that addresses this part, word for word. Use "" if the student did not address it
+            - feedback: if the part is missing or wrong in the student answer, one encouraging and professional sentence (in Hebrew) on how to correct it. Use "" if the student got it right
+
+            Return in this EXACT JSON format, with exactly one entry per model answer part in both lists:
+            {
+            "segments": ["student text for part 1", "student text for part 2", ...],
+            "feedback": ["feedback for part 1", "feedback for part 2", ...]
+            }
+
+            IMPORTANT:
+            - Do NOT rewrite, translate or shorten the student's text, copy it as is
+            - The same student text must not be used for two parts
+            - IGNORE any introductory text that does not address a model answer part
+"""
+
+
+def question_grading_mode(question: Dict) -> str:
+    """The grading_mode of a course_work.json question, "pipeline" when unset or unknown"""
+    mode = question.get('grading_mode') or "pipeline"
+    if mode not in GRADING_MODES:
+        print(f"⚠️ Unknown grading_mode {mode!r} for question {question.get('id')}, using pipeline")
+        return "pipeline"
+    return mode
+
+
+def cos_sim(a, b) -> np.ndarray:
+    """Cosine similarity matrix between the rows of a and b (same as sentence_transformers.util.cos_sim, in numpy)"""
+    a = np.atleast_2d(np.asarray(a, dtype=np.float32))
+    b = np.atleast_2d(np.asarray(b, dtype=np.float32))
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return a @ b.T
+
+
+@dataclass(frozen=True)
+class GradingResult:
+    """Outcome of grading one submission. Immutable, so it can be passed between threads freely"""
+    scores: Tuple[int, ...]
+    max_points: int
+    num_parts: int
+    student_answer: str
+    answer_key: str
+    student_parts: Tuple[str, ...] = ()
+    incorrect_parts: Tuple[str, ...] = ()
+    rubric_method: str = "llm"
+    # "single_pass" when the single-pass call was used, its feedback for the unmatched parts (None: ask separately)
+    grading_mode: str = "pipeline"
+    feedback: Optional[str] = None
+
+    @property
+    def total_score(self) -> int:
+        # more matched parts than the rubric has points (e.g. a sentence-split answer) still caps at the maximum
+        return min(sum(self.scores), self.max_points)
+
+    @property
+    def is_full(self) -> bool:
+        return self.total_score == self.max_points
+
+    def to_dict(self) -> Dict:
+        """The score fields of the /process response"""
+        return {
+            "score": self.total_score,
+            "max_score": self.max_points,
+            "detailed_scores": list(self.scores),
+            "incorrect_parts": list(self.incorrect_parts),
+        }
+
+
+def _parse_rubric_reply(reply: str) -> Tuple[Optional[int], Optional[int]]:
+    """(max points, number of parts) from the rubric analysis reply, None for a number it doesn't give"""
+    points_match = re.search(r'points?:?\s*(\d+)', reply.lower())
+    parts_match = re.search(r'parts?:?\s*(\d+)', reply.lower())
+    return (int(points_match.group(1)) if points_match else None,
+            int(parts_match.group(1)) if parts_match else None)
+
+
+# only responses the grader can use go into the LLM cache (llm_cache.py), a bad one is asked again next time
+LLM_CACHE_VALIDATORS = {
+    "rubric": lambda reply: None not in _parse_rubric_reply(reply),
+    "split": lambda reply: bool(parse_points(reply)[0]),
+    "single_pass": lambda reply: parse_graded_parts(reply, 0) is not None,
+}
 
-def safe_json_loads(json_string):
-    """
-    Safely load JSON by attempting to fix common quote escaping issues.
-    """
-    try:
-        # First try to load as-is
-        return json.loads(json_string)
-    except json.JSONDecodeError:
-        # If it fails, try to fix quote issues
-        try:
-            fixed_string = fix_json_quotes(json_string)
-            return json.loads(fixed_string)
-        except json.JSONDecodeError as e:
-            print(f"Could not parse JSON even after attempting fixes: {e}")
-            print("Fixed string:")
-            print(fixed_string)
-            raise
 
 class RobustGrader:
+    """
+    Long-lived grading engine. Holds the embedding model and Ollama settings only;
+    everything about a submission lives in local variables and the returned GradingResult,
+    so one instance can grade from many threads at once.
+    """
     
-    def __init__(self, ollama_url: str = "http://localhost:11434", model_name: str = "llama3:8b", student_answer: str = "", answer_key: str = ""):
+    def __init__(self, ollama_url: str = OLLAMA_URL, model_name: str = "llama3:8b",
+                 model_registry: Optional[ModelRegistry] = None, embedding_model: str = DEFAULT_EMBEDDING_MODEL, device: Optional[str] = None,
+                 embedding_cache=None, llm_client: Optional[OllamaClient] = None, llm_cache=None,
+                 embedding_backend: str = EMBEDDING_BACKEND, part_matching: str = PART_MATCHING):
         self.ollama_url = ollama_url
         self.model_name = model_name
-        self.student_answer = student_answer
-        self.answer_key = answer_key
-        self.student_answer_parts = []
-        self.incorrect_parts = []
-        self.max_points = 0
-        self.num_parts = 0
-
-        # Load semantic similarity model (your existing setup)
+        # pooled HTTP client shared by every grader talking to this Ollama,
+        # or the process's resident llama.cpp model (same interface)
+        if llm_client is None and LLM_BACKEND == "llama_cpp":
+            from llama_cpp_client import get_llama_cpp_client
+            llm_client = get_llama_cpp_client()
+        llm_client = llm_client or get_client(ollama_url, OLLAMA_MAX_CONCURRENCY)
+        # circuit breaker + adaptive timeouts, shared by every grader using this backend
+        self.llm_health = get_health(getattr(llm_client, "base_url", None) or type(llm_client).__name__)
+        self.llm = GuardedLLMClient(llm_client, self.llm_health)
+        # optional LLMCache (llm_cache.py), repeated rubric/split prompts are answered from disk
+        if llm_cache is not None:
+            self.llm = CachedLLMClient(self.llm, llm_cache, validators=LLM_CACHE_VALIDATORS)
+        # runs independent LLM stages of one grade_answer side by side
+        self._stage_pool = ThreadPoolExecutor(max_workers=2 * OLLAMA_MAX_CONCURRENCY, thread_name_prefix="grader-stage")
+        self.model_registry = model_registry or default_registry
+        self.embedding_model = embedding_model
+        self.device = device
+        # "torch", "cpu" or "int8" (embedding_backends.py)
+        self.embedding_backend = embedding_backend
+        # identifies the vectors this grader produces, for caches and precomputed artifacts
+        self.embedding_model_id = embedding_model_id(embedding_model, embedding_backend)
+        # optional EmbeddingCache (embedding_cache.py), only texts it hasn't seen go to the model
+        self.embedding_cache = embedding_cache
+        # "mutual_best" or "hungarian" (matching.py)
+        self.part_matching = part_matching
+
+        # Semantic similarity model comes from the shared registry, loaded once per process
+        # on first use (backend.py warms it up in the background), see similarity_model
+        self._model_failed_at = None
+        # (checked at, reachable) of the last LLM probe, see llm_reachable
+        self._llm_status = (0.0, False)
+
+    @property
+    def similarity_model(self):
+        """The embedding model, or None if it failed to load (retried after MODEL_RETRY_SECONDS)"""
+        if self._model_failed_at is not None and time.monotonic() - self._model_failed_at < MODEL_RETRY_SECONDS:
+            return None
         try:
-            self.similarity_model = SentenceTransformer('MPA/sambert')
-            
+            model = self.model_registry.get(self.embedding_model, self.device, self.embedding_backend)
+            self._model_failed_at = None
+            return model
         except Exception as e:
             print(f"❌ Failed to load semantic model: {e}")
-            self.similarity_model = None
-        
-        # Test Ollama connection
-        self._test_ollama_connection()
+            self._model_failed_at = time.monotonic()
+            return None
+
+    def llm_reachable(self, max_age: float = 5.0) -> bool:
+        """Whether the LLM backend answered a probe in the last max_age seconds (for /readyz)"""
+        checked_at, reachable = self._llm_status
+        if time.monotonic() - checked_at > max_age:
+            reachable = self._test_ollama_connection()
+            self._llm_status = (time.monotonic(), reachable)
+        return reachable
     
+    def after_fork(self):
+        """Give a forked worker process its own threads and connections (see serve.py)"""
+        self._stage_pool = ThreadPoolExecutor(max_workers=2 * OLLAMA_MAX_CONCURRENCY, thread_name_prefix="grader-stage")
+        self.llm.reset()
+
     def _test_ollama_connection(self):
         """Test if Ollama is running and accessible"""
         try:
-            response = requests.get(f"{self.ollama_url}/api/tags", timeout=5)
-            if response.status_code == 200:
-                
-                return True
+            self.llm.tags(timeout=2)
+            return True
         except Exception as e:
             print(f"⚠️ Ollama connection issue: {e}")
             print("   Grader will work with semantic similarity only")
         return False
     
-    def _call_ollama(self, prompt: str, max_retries: int = 2, num_predict: int = 100) -> Optional[str]:
+    def _call_ollama(self, prompt: str, max_retries: int = 2, num_predict: int = 100, call_site: str = "generic") -> Optional[str]:
         """Simple Ollama API call with error handling"""
+        options = {
+            "temperature": 0.1,  # Low temperature for consistency
+            "top_p": 0.9,
+            "num_predict": num_predict   # Keep responses short
+        }
         for attempt in range(max_retries):
             try:
-                data = {
-                    "model": self.model_name,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.1,  # Low temperature for consistency
-                        "top_p": 0.9,
-                        "num_predict": num_predict   # Keep responses short
-                    }
-                }
-                
-                response = requests.post(
-                    f"{self.ollama_url}/api/generate",
-                    json=data,
-                    timeout=30
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return result['response'].strip()
-                    
+                result = self.llm.generate(self.model_name, prompt, options, call_site=call_site, timeout=30)
+                return result['response'].strip()
+            except BackendUnavailable as e:
+                # breaker open or no time left, retrying would only wait
+                print(f"   ⏭️ Skipping LLM: {e}")
+                break
             except Exception as e:
                 print(f"   LLM attempt {attempt + 1} failed: {e}")
                 
         print("   🔴 All LLM attempts failed, using fallback logic")
+        mark_degraded()
         return None
     
-    def grade_answer(self, rubric: str, answer_key: str, student_answer: str) -> Dict:
+    def _call_ollama_stream(self, prompt: str, num_predict: int = 100, call_site: str = "generic") -> Iterator[str]:
+        """Ollama API call with token streaming, yields text chunks as they are generated"""
+        options = {
+            "temperature": 0.1,
+            "top_p": 0.9,
+            "num_predict": num_predict
+        }
+
+        try:
+            for chunk in self.llm.generate_stream(self.model_name, prompt, options, call_site=call_site, timeout=30):
+                if chunk.get('response'):
+                    yield chunk['response']
+        except Exception as e:
+            print(f"   🔴 LLM stream failed: {e}")
+
+    def grade_answer(self, rubric: str, answer_key: str, student_answer: str, artifacts=None,
+                     mode: str = "pipeline") -> GradingResult:
         """
         Main grading function with simplified approach
+        artifacts: precomputed QuestionArtifacts for this question (see artifacts.py).
+        When given, the rubric analysis and answer key split are taken from it instead of the LLM.
+        mode: "pipeline" or "single_pass" (see GRADING_MODES)
         """
         print("\n🎯 Starting grading process...")
         
-        # Step 1: Analyze rubric (simple extraction)
-    
-        rubric_info = self._analyze_rubric_simple(rubric)
-      
-        
-        
-   
-        student_key_parts = self._split_answer_key(student_answer, rubric_info["num_parts"])
+        part_feedback = None
+        if artifacts is not None or mode == "single_pass":
+            # single_pass needs the answer key parts before it can ask about the student answer
+            rubric_info, answer_key_parts, key_embeddings = self._question_parts(rubric, answer_key, artifacts)
+            student_key_parts, part_feedback = self._split_student(student_answer, rubric_info, answer_key_parts, mode)
+        else:
+            # Step 1: Analyze rubric (simple extraction), both splits only need its num_parts
+            with span("rubric"):
+                rubric_info = self._analyze_rubric_simple(rubric)
+
+            # split the answer key and the student answer at the same time
+            # copy_context: the split runs under this request's latency budget (backend_health.py)
+            key_split = self._stage_pool.submit(contextvars.copy_context().run,
+                                                self._timed_split, "split_key", answer_key, rubric_info["num_parts"])
+            student_key_parts = self._timed_split("split_student", student_answer, rubric_info["num_parts"],
+                                                  sentence_fallback=True)
+            answer_key_parts = key_split.result()
+            key_embeddings = None
         # print(f"   📝 Studen Key parts: \n{student_key_parts}")
 
-        # split answer key into parts
-        answer_key_parts = self._split_answer_key(answer_key, rubric_info["num_parts"])
-        # print(f"   📝 Answer key parts: \n{answer_key_parts}")
+        # Step 3: Grade using semantic similarity + simple LLM checks
+        print("⚖️ Step 3: Grading student answer...")
+        with span("score"):
+            scores, incorrect_parts, key_matches = self._grade_with_semantic_focus(
+                student_key_parts, student_answer, rubric_info, answer_key_parts, key_embeddings
+            )
+        
+        return self._result(rubric_info, answer_key, student_answer, student_key_parts, scores, incorrect_parts,
+                            key_matches, part_feedback)
 
+    def grade_batch(self, submissions: List[Tuple[str, str, str, object, str]], max_workers: int = 4) -> List[GradingResult]:
+        """
+        Grade many submissions at once. submissions are (rubric, answer_key, student_answer, artifacts, mode) tuples.
 
+        The student splits (LLM calls) run concurrently, at most max_workers at a time,
+        all student parts of the batch are encoded in a single encode call,
+        and questions shared by several submissions are only analyzed once.
+        Results are returned in input order.
+        """
+        print(f"\n🎯 Starting batch grading of {len(submissions)} submissions...")
+
+        # question level work, once per distinct question
+        questions = {}
+        for rubric, answer_key, _, artifacts, _ in submissions:
+            if (rubric, answer_key) not in questions:
+                questions[(rubric, answer_key)] = self._question_parts(rubric, answer_key, artifacts)
+
+        def split(submission):
+            rubric, answer_key, student_answer, _, mode = submission
+            rubric_info, answer_key_parts, _ = questions[(rubric, answer_key)]
+            return self._split_student(student_answer, rubric_info, answer_key_parts, mode)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, split, submission) for submission in submissions]
+            splits = [future.result() for future in futures]
+        all_student_parts = [student_key_parts for student_key_parts, _ in splits]
+
+        # one batched encode for every student part in the batch
+        flat_parts = [part for parts in all_student_parts for part in parts]
+        flat_embeddings = self._encode(flat_parts) if flat_parts and self.similarity_model else None
+
+        # similarity matrix of every submission, then the part matching of the whole batch in one call
+        similarities = [None] * len(submissions)
+        offset = 0
+        for index, ((rubric, answer_key, _, _, _), student_key_parts) in enumerate(zip(submissions, all_student_parts)):
+            _, answer_key_parts, key_embeddings = questions[(rubric, answer_key)]
+            if flat_embeddings is not None and student_key_parts and answer_key_parts:
+                student_embeddings = flat_embeddings[offset:offset + len(student_key_parts)]
+                similarities[index] = self._semantic_score_answers(
+                    answer_key_parts, student_key_parts, key_embeddings, student_embeddings)
+            offset += len(student_key_parts)
+        scored = [index for index, matrix in enumerate(similarities) if matrix is not None]
+        matches = [None] * len(submissions)
+        if scored:
+            batch_matches = match_parts(stack_similarities([similarities[i] for i in scored]), self.part_matching)
+            for index, row in zip(scored, batch_matches):
+                matches[index] = row[:similarities[index].shape[0]]
+
+        results = []
+        for index, ((rubric, answer_key, student_answer, _, _), (student_key_parts, part_feedback)) in enumerate(zip(submissions, splits)):
+            rubric_info, answer_key_parts, key_embeddings = questions[(rubric, answer_key)]
+            with span("score"):
+                scores, incorrect_parts, key_matches = self._grade_with_semantic_focus(
+                    student_key_parts, student_answer, rubric_info, answer_key_parts, key_embeddings,
+                    similarities=similarities[index], matches=matches[index]
+                )
+            results.append(self._result(rubric_info, answer_key, student_answer, student_key_parts, scores, incorrect_parts,
+                                        key_matches, part_feedback))
+        return results
 
+    def _split_student(self, student_answer: str, rubric_info: Dict, answer_key_parts: List[str],
+                       mode: str) -> Tuple[List[str], Optional[List[str]]]:
+        """
+        The student's parts. In single_pass mode also the feedback per answer key part; when the
+        single-pass call fails, or none of the text it quotes is in the student answer, it falls back to the split.
+        """
+        if mode == "single_pass" and answer_key_parts:
+            with span("single_pass"):
+                graded = self._single_pass(answer_key_parts, student_answer)
+            if graded is not None:
+                segments, part_feedback = graded
+                quoted = [segment for segment in segments if segment]
+                # the model may paraphrase or invent text, only what the student actually wrote is scored
+                found = [segment for segment in quoted if segment_in_text(segment, student_answer)]
+                if len(found) < len(quoted):
+                    print(f"   ⚠️ Single pass: {len(quoted) - len(found)} segments not found in the student answer, dropped")
+                if found or not quoted:
+                    SINGLE_PASS.inc(outcome="ok")
+                    print(f"   🎯 Single pass: student addressed {len(found)}/{len(answer_key_parts)} answer key parts")
+                    return found, part_feedback
+            SINGLE_PASS.inc(outcome="fallback")
+            print("   ↩️ Single pass failed, falling back to the split pipeline")
+        return self._timed_split("split_student", student_answer, rubric_info["num_parts"], sentence_fallback=True), None
+
+    def _single_pass(self, answer_key_parts: List[str], student_answer: str) -> Optional[Tuple[List[str], List[str]]]:
+        """One LLM call: (student text per answer key part, feedback per answer key part), None on failure"""
+        prompt = self._single_pass_prompt(answer_key_parts, student_answer)
+        extra = {"format": GRADED_PARTS_SCHEMA} if OLLAMA_STRUCTURED_SPLIT else {}
+        options = {
+            "num_predict": 10000,
+            "temperature": 0.1
+        }
+        try:
+            result = self.llm.generate(self.model_name, prompt, options, call_site="single_pass", timeout=None, **extra)
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            return None
+        graded = parse_graded_parts(result['response'], len(answer_key_parts))
+        if graded is None:
+            print(f"❌ Could not parse the single-pass response: {result['response'][:200]}")
+        return graded
+
+    def _single_pass_prompt(self, answer_key_parts: List[str], student_answer: str) -> str:
+        numbered = "\n".join(f"            {i + 1}. {part}" for i, part in enumerate(answer_key_parts))
+        return f"""{SINGLE_PASS_INSTRUCTIONS}
+            THERE ARE {len(answer_key_parts)} model answer parts:
+{numbered}
+
+            Student answer:
+            {student_answer}
 
-        # Step 3: Grade using semantic similarity + simple LLM checks
-        print("⚖️ Step 3: Grading student answer...")
-        grading_result = self._grade_with_semantic_focus(
-            student_key_parts, student_answer, rubric_info, answer_key_parts
+            Remember: ONLY return the JSON, nothing else."""
+
+    def _timed_split(self, stage: str, text: str, num_parts: int, sentence_fallback: bool = False) -> List[str]:
+        """
+        sentence_fallback: for student answers only. An answer key split into sentences would make
+        every sentence worth a point, so a failed key split stays empty (and scores 0).
+        """
+        with span(stage):
+            parts = self._split_answer_key(text, num_parts)
+            if not parts and text.strip() and sentence_fallback:
+                # degraded: LLM down or out of time, score sentence by sentence instead of giving 0
+                SPLIT_STRATEGY.inc(strategy="sentences")
+                mark_degraded()
+                parts = split_sentences(text)
+            return parts
+
+    def _question_parts(self, rubric: str, answer_key: str, artifacts=None) -> Tuple[Dict, List[str], Optional[np.ndarray]]:
+        """Rubric info, answer key parts and (when precomputed) answer key embeddings for a question"""
+        if artifacts is not None:
+            # Step 1 + answer key split were done ahead of time
+            print(f"   📦 Using precomputed artifacts for question {artifacts.question_id}")
+            return artifacts.rubric_info(), artifacts.key_parts, artifacts.key_embeddings
+
+        # Step 1: Analyze rubric (simple extraction)
+        with span("rubric"):
+            rubric_info = self._analyze_rubric_simple(rubric)
+
+        # split answer key into parts
+        answer_key_parts = self._timed_split("split_key", answer_key, rubric_info["num_parts"])
+        return rubric_info, answer_key_parts, None
+
+    def _result(self, rubric_info: Dict, answer_key: str, student_answer: str, student_key_parts: List[str],
+                scores: List[int], incorrect_parts: List[str], key_matches: List[int],
+                part_feedback: Optional[List[str]] = None) -> GradingResult:
+        """key_matches: answer key part matched by each student part (-1 for none), see _score_answers"""
+        feedback = None
+        if part_feedback is not None:
+            # feedback of the answer key parts no student part scored on, missing ones included
+            matched = {int(match) for match in key_matches if match >= 0}
+            feedback = " ".join(text for i, text in enumerate(part_feedback) if i not in matched and text) or None
+        return GradingResult(
+            scores=tuple(scores),
+            max_points=rubric_info["max_points"],
+            num_parts=rubric_info["num_parts"],
+            student_answer=student_answer,
+            answer_key=answer_key,
+            student_parts=tuple(student_key_parts),
+            incorrect_parts=tuple(incorrect_parts),
+            rubric_method=rubric_info["method"],
+            grading_mode="pipeline" if part_feedback is None else "single_pass",
+            feedback=feedback,
         )
-        
-      
-        return grading_result
     
     def _analyze_rubric_simple(self, rubric: str) -> Dict[str, int]:
         """
@@ -160,7 +500,7 @@ class RobustGrader:
         How many maximum points? How many parts to check?
 
         Format: "Points: X, Parts: Y"
-        """)
+        """, call_site="rubric")
 
 
         max_points = 3  # Safe default
@@ -168,15 +508,12 @@ class RobustGrader:
         
         if llm_result:
             # Try to extract numbers from LLM response
-            points_match = re.search(r'points?:?\s*(\d+)', llm_result.lower())
-            parts_match = re.search(r'parts?:?\s*(\d+)', llm_result.lower())
+            points, parts = _parse_rubric_reply(llm_result)
             
-            if points_match:
-                max_points = int(points_match.group(1))
-                self.max_points = max_points
-            if parts_match:
-                num_parts = int(parts_match.group(1))
-                self.num_parts = num_parts
+            if points is not None:
+                max_points = points
+            if parts is not None:
+                num_parts = parts
         
 
         
@@ -193,68 +530,47 @@ class RobustGrader:
         """
         Step 2: Split answer key into parts
         Uses multiple strategies with fallbacks
+        Returns the raw text of each part, empty list if the split failed.
         """
 
-            # Ollama API endpoint
-        # url = "http://localhost:11434/api/generate"
+        # Fast path: cut at ordinal markers (האחת, השנייה, ...) without an LLM round trip
+        segments = segment_ordinals(student_answer, num_parts)
+        if segments is not None:
+            SPLIT_STRATEGY.inc(strategy="segmenter")
+            print(f"   ✂️ Split into {len(segments)} parts by ordinal markers, skipping LLM")
+            return segments
+        SPLIT_STRATEGY.inc(strategy="llm")
 
-        prompt = f"""CRITICAL: Return ONLY the JSON array below, with NO additional text before or after. Do not add any explanations, headers, or other text.
+        prompt = self._split_prompt(student_answer, num_parts)
+        extra = {"format": POINTS_SCHEMA} if OLLAMA_STRUCTURED_SPLIT else {}
 
-            Analyze the Hebrew text and extract points based on these rules:
-            THERE ARE {num_parts} parts total - this is the expected number of points to extract
-            - If the text contains numbered ordinal markers (האחת, השנייה, השלישית, הרביעית, והאחרונה, etc.), extract each numbered point separately. according to {num_parts} parts total
-            - If the text does NOT contain numbered markers, treat the entire text as ONE single point
-            - IGNORE any introductory text, preamble, or general information that appears BEFORE the first numbered ordinal marker
-            - Only start extracting from the first numbered marker (האחת, השנייה, etc.) onwards
-
-            Return in this EXACT JSON format:
-            [
-            {{"point1": "COMPLETE FULL TEXT of the first point including all words"}},
-            {{"point2": "COMPLETE FULL TEXT of the second point including all words"}},
-            {{"point3": "COMPLETE FULL TEXT of the third point including all words"}}
-            ... (increment point numbers: point1, point2, point3, etc. for each entry)
-            ]
-
-            IMPORTANT: 
-            - Do NOT artificially split continuous text that lacks numbered markers
-            - Include the COMPLETE text for each point. Do not truncate or shorten anything
-            - CRITICAL: When numbered markers exist, IGNORE any text before the first marker and only extract from the numbered sections
-            - Only create multiple JSON entries when there are clear numbered divisions in the text
-            - Target {num_parts} total parts, but prioritize natural divisions over forced splitting
-            - For numbered content: each point should include the ordinal marker and all text until the next marker (or end)
-
-            Text to process:
-            {student_answer}
-
-            Remember: ONLY return the JSON array, nothing else."""
-
-        data = {
-            "model": self.model_name,
-            "prompt":  prompt,
-            "stream": False,  # Get complete response at once
-            "options": {
-                "num_predict": 10000,  # Allow longer responses
-                "temperature": 0.1    # More deterministic output
-            }
+        options = {
+            "num_predict": 10000,  # Allow longer responses
+            "temperature": 0.1    # More deterministic output
         }
         
         try:
             print("Sending request to Ollama...")
-            response = requests.post(f"{self.ollama_url}/api/generate", json=data)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result['response'][-1] != "]":
-                    result['response'] += "]"
-                return result['response']
-
-            else:
-                print(f"❌ Error: HTTP {response.status_code}")
-                print(response.text)
+            result = self.llm.generate(self.model_name, prompt, options, call_site="split", timeout=None, **extra)
+            return self._prepare_array(result['response'])
         except Exception as e:
             print(f"❌ Error: {e}")
+        return []
     
-    def _grade_with_semantic_focus(self, student_key_parts: List[str], student_answer: str, rubric_info: Dict, answer_key_parts: List[str]) -> Dict:
+    def _split_prompt(self, text: str, num_parts: int) -> str:
+        return f"""{SPLIT_INSTRUCTIONS}
+            THERE ARE {num_parts} parts total - this is the expected number of points to extract
+
+            Text to process:
+            {text}
+
+            Remember: ONLY return the JSON, nothing else."""
+
+    def _grade_with_semantic_focus(self, student_key_parts: List[str], student_answer: str, rubric_info: Dict, answer_key_parts: List[str],
+                                   key_embeddings: Optional[np.ndarray] = None,
+                                   student_embeddings: Optional[np.ndarray] = None,
+                                   similarities: Optional[np.ndarray] = None,
+                                   matches: Optional[np.ndarray] = None) -> Tuple[List[int], List[str], List[int]]:
         """
         Main grading logic - semantic similarity focused with intelligent part matching
         
@@ -262,17 +578,14 @@ class RobustGrader:
         """
 
     
-        final_scores = self._score_answers(answer_key_parts, student_key_parts, rubric_info["num_parts"])
-
-  
-        
-        return final_scores
+        return self._score_answers(answer_key_parts, student_key_parts, rubric_info["num_parts"],
+                                   rubric_info["max_points"], key_embeddings, student_embeddings, similarities, matches)
     
     def _semantic_similarity(self, text1: str, text2: str) -> float:
         """Calculate semantic similarity between two texts"""
         try:
-            embeddings = self.similarity_model.encode([text1, text2])
-            similarity = float(util.cos_sim(embeddings[0], embeddings[1]))
+            embeddings = self._encode([text1, text2])
+            similarity = float(cos_sim(embeddings[0], embeddings[1])[0][0])
             return similarity
         except Exception as e:
             print(f"      ⚠️ Semantic similarity failed: {e}")
@@ -293,7 +606,7 @@ class RobustGrader:
             Answer only: YES or NO
             """
         
-        result = self._call_ollama(prompt)
+        result = self._call_ollama(prompt, call_site="llm_check")
         if result:
             result_clean = result.upper().strip()
             return "YES" in result_clean or "כן" in result_clean
@@ -301,118 +614,127 @@ class RobustGrader:
         # Fallback: simple keyword matching
         return self._keyword_fallback(reference, student_text)
     
-    def _score_answers(self, answer_key_parts: List[str], student_key_parts: List[str], num_parts: int) -> List[int]:
+    def _score_answers(self, answer_key_parts: List[str], student_key_parts: List[str], num_parts: int, max_points: int,
+                       key_embeddings: Optional[np.ndarray] = None,
+                       student_embeddings: Optional[np.ndarray] = None,
+                       similarities: Optional[np.ndarray] = None,
+                       matches: Optional[np.ndarray] = None) -> Tuple[List[int], List[str], List[int]]:
         """
         Score student answers against answer key using semantic similarity
+        Returns the score of each student part, the student parts that did not match
+        and the answer key part each student part matched (-1 for none).
+        similarities / matches: already computed for this submission (grade_batch matches a whole batch at once)
         """
         if not answer_key_parts or not student_key_parts:
             print("⚠️ Warning: Missing answer key or student parts")
-            return [0] * num_parts
-            
-        # AND. case of just one point.
-        if len(answer_key_parts) == 1 and len(student_key_parts) == 1:
-            semantic_mapping = self._semantic_score_answers(answer_key_parts, student_key_parts)
-            if semantic_mapping[0][0] > 0.8:
-                scores [0] = self.max_points
-                return scores
-         #     not sure what this was for. leaving it for now before the demo as it works rn.
-        if len(answer_key_parts) == 1 or len(student_key_parts) == 1:
-            print("⚠️ Warning: Only one part detected, returning zero scores")
-            return [0] * len(student_key_parts)
-        
+            return [0] * num_parts, [], []
 
-     
-        
-        #  Semantic similarity matching
-        if self.similarity_model:
-            semantic_mapping = self._semantic_score_answers(answer_key_parts, student_key_parts)
-            print(f"📊 Semantic mapping shape: {semantic_mapping.shape if hasattr(semantic_mapping, 'shape') else 'N/A'}")
-        else:
-            print("❌ No similarity model available")
-            return [0] * num_parts
+        #  Semantic similarity matching, rows = student parts, columns = answer key parts
+        if similarities is None:
+            if not self.similarity_model:
+                print("❌ No similarity model available")
+                return [0] * num_parts, [], []
+            similarities = self._semantic_score_answers(answer_key_parts, student_key_parts, key_embeddings, student_embeddings)
 
+        # one-part answer key answered in one part: all of the points or none
+        if len(answer_key_parts) == 1 and len(student_key_parts) == 1:
+            if similarities[0][0] > SINGLE_PART_THRESHOLD:
+                return [max_points], [], [0]
+            return [0], list(student_key_parts), [-1]
 
-        # Ensure we have the right number of scores based on actual semantic mapping size
-        actual_student_parts = len(semantic_mapping) if len(semantic_mapping) > 0 else num_parts
-        scores = [0] * actual_student_parts
-        
-        for i in range(len(semantic_mapping)):
-            # find the maximum value in the line i, call max value index j
-            max_value_in_line = np.max(semantic_mapping[i])
-            j = np.argmax(semantic_mapping[i])
-            
-            # then check the maximum value of the j column
-            column_j = semantic_mapping[:, j]
-            max_index_in_column_j = np.argmax(column_j)
-            
-            # if i==j and score > 0.7, give 1 point, otherwise 0 points
-            if max_index_in_column_j == i and max_value_in_line > 0.7:
-                scores[i] = 1
-            else:
-                # Only append if we have student answer parts and index is valid
-                if hasattr(self, 'student_answer_parts') and i < len(self.student_answer_parts):
-                    self.incorrect_parts.append(self.student_answer_parts[i])
-                scores[i] = 0
+        # a point for every student part matched to an answer key part (matching.py)
+        if matches is None:
+            matches = match_parts(similarities, self.part_matching)
+        scores = [1 if match >= 0 else 0 for match in matches]
+        incorrect_parts = [part for part, match in zip(student_key_parts, matches) if match < 0]
 
         print(scores)
-        return scores
+        return scores, incorrect_parts, [int(match) for match in matches]
     
-    def _prepare_array(self, parts: List[str]) -> List[str]:
+    def _prepare_array(self, response: str) -> List[str]:
         """
         recieve LLM made "json" return just the values, raw answers.
-
+        Tolerates unescaped quotes and truncated output (see point_parser.py).
         """
-
-        data = safe_json_loads(parts)
-        array = []
-        for part_str in data:
-            for key, value in part_str.items():
-                array.append(value)
-   
-        return array
+        parts, outcome = parse_points(response)
+        SPLIT_PARSE.inc(outcome=outcome)
+        if parts is None:
+            print(f"❌ Could not find any points in the LLM response: {response[:200]}")
+            return []
+        return parts
     
-    def _semantic_score_answers(self, answer_key_parts: List[str], student_key_parts: List[str]) -> List[int]:
+    def _encode(self, texts: List[str]):
+        """Encode with the shared model, through the embedding cache when there is one"""
+        if self.embedding_cache is not None:
+            return self.embedding_cache.encode(texts, self._encode_uncached)
+        return self._encode_uncached(texts)
+
+    def _encode_uncached(self, texts: List[str]):
+        """Run the model, recording batch size and encode time"""
+        start = time.perf_counter()
+        embeddings = self.similarity_model.encode(texts)
+        record_encode(self.embedding_model_id, len(texts), time.perf_counter() - start)
+        return embeddings
+
+    def _semantic_score_answers(self, answer_key_parts: List[str], student_key_parts: List[str],
+                                key_embeddings: Optional[np.ndarray] = None,
+                                student_embeddings: Optional[np.ndarray] = None) -> np.ndarray:
         """
-        get dictionary of answers
-        process to get just values
-        turn to embeddings
+        get the split parts of both answers
+        turn to embeddings (either side may be precomputed, e.g. by grade_batch)
         create similarity matrix
         """
 
-        array1= self._prepare_array(student_key_parts)
-        array2= self._prepare_array(answer_key_parts)
+        array1 = student_key_parts
+        array2 = answer_key_parts
 
-        self.student_answer_parts = array1
         # check for overlap and slice off the overlap
 
 
-        model = SentenceTransformer('MPA/sambert')      
-        embeddings1 = model.encode(array1)
-        embeddings2 = model.encode(array2)
+        with span("semantic"):
+            embeddings1 = student_embeddings if student_embeddings is not None else self._encode(array1)
+            embeddings2 = key_embeddings if key_embeddings is not None else self._encode(array2)
     
       # Calculate cross-similarity between JSON1 strings and JSON2 strings
         # Fix: swap order so rows=student, columns=answer_key
-        similarities = util.cos_sim(embeddings1, embeddings2)
-        print(similarities.numpy())
+        similarities = cos_sim(embeddings1, embeddings2)
+        print(similarities)
 
-        return similarities.numpy()
+        return similarities
 
-    def _feedback(self, result: List[int], ):
-        print(f"🔍 Incorrect Parts: {self.incorrect_parts}")
-        if sum(result) == self.max_points:
-            return "full answer"
-        else:
-            prompt = f"""
-            this is the full answer {self.answer_key}
-            this is the student answer {self.student_answer}
-            this is the incorrect parts {self.incorrect_parts}
+    def _feedback_prompt(self, result: GradingResult) -> str:
+        return f"""
+            this is the full answer {result.answer_key}
+            this is the student answer {result.student_answer}
+            this is the incorrect parts {list(result.incorrect_parts)}
             your task is to give encouraging and helpful feedback on the student answer, based on the full answer and the incorrect parts. make it all about correcting the error. consice and profesional. IMPORTANT: Your response must be exactly 2 sentences maximum.
             """
+
+    def _feedback(self, result: GradingResult):
+        print(f"🔍 Incorrect Parts: {list(result.incorrect_parts)}")
+        if result.is_full:
+            return "full answer"
+        if result.feedback is not None:
+            # written by the single-pass call
+            return result.feedback
         
-        feedback_result = self._call_ollama(prompt, num_predict=1000)
+        with span("feedback"):
+            feedback_result = self._call_ollama(self._feedback_prompt(result), num_predict=1000, call_site="feedback")
 
         return feedback_result
 
+    def _feedback_stream(self, result: GradingResult) -> Iterator[str]:
+        """Same as _feedback, but yields the feedback text as Ollama generates it"""
+        print(f"🔍 Incorrect Parts: {list(result.incorrect_parts)}")
+        if result.is_full:
+            yield "full answer"
+            return
+        if result.feedback is not None:
+            yield result.feedback
+            return
+
+        yield from self._call_ollama_stream(self._feedback_prompt(result), num_predict=1000, call_site="feedback")
+
       
   
 """
@@ -420,27 +742,42 @@ grader answer
     _analyze_rubric_simple
         call llm, and regex extract max points and num parts
     split answers to parts with _split_answer_key
-        call llm, return json of sub parts of the full answer
+        segment_ordinals (segmenter.py) cuts at ordinal markers when it is confident
+        otherwise call llm, parse json of sub parts of the full answer into a list
+            (with OLLAMA_STRUCTURED_SPLIT the response is constrained to {"points": [...]} by a JSON schema)
+            _prepare_array
+                parse_points (point_parser.py)
+                    json.loads, or a single linear scan that tolerates unescaped quotes and truncation
+        (rubric analysis and answer key split come from artifacts.py when precomputed)
     _grade_with_semantic_focus
         does nothing...
         _score_answers
             _semantic_score_answers
-                _prepare_array
-                    safe_json_loads
-                        unload json that has unescaped quotes
-                        fix_json_quotes
-                            extracts values from json
-                extracts raw data, into array.
                 encode to embeddings
                 create similarity matrix
-            save incorrect answer partrs
+            match_parts (matching.py): mutual best matches, or the optimal one-to-one assignment
+            collect incorrect answer parts
             print scores
+    returns an immutable GradingResult, nothing is kept on the grader
+grade_batch
+    same pipeline for many submissions: concurrent student splits, one encode for all student parts,
+    one match_parts call on the stacked similarity matrices of the batch
 _feedback
     call llm and return feedback based on wrong answer parts
+_feedback_stream
+    same, but yields tokens as ollama streams them (used by /process/stream)
+single_pass grading mode (question "grading_mode": "single_pass")
+    answer key parts from artifacts, then one llm call (_single_pass) returns the student text
+    for every answer key part plus feedback for the parts the student missed
+    segments not found in the student answer (segment_in_text, segmenter.py) are dropped
+    the segments are scored by _score_answers as usual, feedback is kept for the answer key parts
+    no segment matched
+    no separate feedback call, falls back to the split pipeline if the response does not parse
 """
 
 """
 theres are 4 [ rubric 2 answer 1 feedback] LLM calls. price is ~ a cent per submition.\
 2 embeddings calls
+with artifacts and single_pass: 1 LLM call per submission
 
 """
\ No newline at end of file
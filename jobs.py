@@ -0,0 +1,296 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from metrics import registry
+
+JOBS_DB = os.environ.get("JOBS_DB", "jobs.db")
+# a running job whose owner stopped renewing its lease for this long goes back to the queue
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 120))
+# how often idle workers look for jobs submitted to other processes
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", 1))
+
+JOBS = registry.counter(
+    "grading_jobs_total", "Grading jobs by outcome (queued, rejected, done, failed)", ["outcome"])
+JOB_WAIT_SECONDS = registry.histogram(
+    "grading_job_wait_seconds", "Time jobs spent queued before a worker picked them up")
+JOB_RUN_SECONDS = registry.histogram(
+    "grading_job_run_seconds", "Time spent grading a job")
+
+
+class QueueFull(Exception):
+    """The job queue is at its depth limit"""
+
+
+class JobStore:
+    """
+    Grading jobs in a local SQLite file, so queued and finished jobs survive a restart.
+
+    One row per job: the submission (question_id, text), its status
+    (queued -> running -> done / failed) and the /process style result as JSON.
+    The table is also the queue: several worker processes share the file, and claim_next() hands
+    every queued job to exactly one of them. A running job records its owner and a lease.
+    """
+
+    def __init__(self, path: str = JOBS_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                question_id INTEGER,
+                text TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                owner TEXT,
+                lease_until REAL
+            )""")
+        # files created before jobs had owners
+        columns = {row["name"] for row in self._query("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                try:
+                    self._execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+                except sqlite3.OperationalError:
+                    pass  # another process added it first
+        self._execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._execute("CREATE INDEX IF NOT EXISTS jobs_question ON jobs (question_id, started_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # an SQLite connection must not be used across fork, every process opens its own
+        if self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connection().execute(sql, params)
+
+    def _query(self, sql: str, params=()) -> List[Dict]:
+        with self._lock:
+            return [dict(row) for row in self._connection().execute(sql, params).fetchall()]
+
+    def add(self, question_id, text: str) -> Dict:
+        job = {"id": uuid.uuid4().hex, "question_id": question_id, "text": text,
+               "status": "queued", "created_at": time.time()}
+        self._execute("INSERT INTO jobs (id, question_id, text, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                      (job["id"], question_id, text, job["status"], job["created_at"]))
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        rows = self._query("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        job = rows[0]
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def claim_next(self, owner: str, lease: float) -> Optional[Dict]:
+        """
+        Mark the next queued job as running for owner and return it, None when nothing is queued.
+        Next is the oldest job of the question served least recently (never served first), so
+        questions take turns. BEGIN IMMEDIATE: one thread or process claims at a time.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("""
+                    SELECT j.id, j.question_id, j.text, j.created_at FROM jobs j
+                    LEFT JOIN (SELECT question_id, MAX(started_at) AS served FROM jobs
+                               WHERE started_at IS NOT NULL GROUP BY question_id) s
+                           ON s.question_id IS j.question_id
+                    WHERE j.status = 'queued'
+                    ORDER BY s.served, j.created_at
+                    LIMIT 1""").fetchone()
+                if row is not None:
+                    conn.execute("UPDATE jobs SET status = 'running', started_at = ?, owner = ?, lease_until = ? WHERE id = ?",
+                                 (now, owner, now + lease, row["id"]))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return dict(row) if row is not None else None
+
+    def renew(self, owner: str, lease: float) -> int:
+        """Extend the lease of every job owner is running"""
+        return self._execute("UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = 'running'",
+                             (time.time() + lease, owner)).rowcount
+
+    def finish(self, job_id: str, owner: str, result: Dict):
+        # owner: a job that was taken away (lease ran out) keeps the result of whoever runs it now
+        self._execute("UPDATE jobs SET status = 'done', result = ?, finished_at = ? WHERE id = ? AND owner = ?",
+                      (json.dumps(result, ensure_ascii=False), time.time(), job_id, owner))
+
+    def fail(self, job_id: str, owner: str, error: str):
+        self._execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ? AND owner = ?",
+                      (error, time.time(), job_id, owner))
+
+    def count_queued(self) -> int:
+        return self._query("SELECT COUNT(*) AS n FROM jobs WHERE status = 'queued'")[0]["n"]
+
+    def requeue_stale(self, owner_alive: Callable[[Optional[str]], bool]) -> int:
+        """Running jobs whose lease ran out, or whose owner owner_alive says is gone, go back to the queue"""
+        now = time.time()
+        requeued = 0
+        for row in self._query("SELECT id, owner, lease_until FROM jobs WHERE status = 'running'"):
+            if (row["lease_until"] or 0) >= now and owner_alive(row["owner"]):
+                continue
+            # only if nobody claimed or finished it in the meantime
+            requeued += self._execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL, owner = NULL, lease_until = NULL "
+                "WHERE id = ? AND status = 'running' AND owner IS ?", (row["id"], row["owner"])).rowcount
+        return requeued
+
+    def purge(self, older_than: float) -> int:
+        """Delete finished jobs older than older_than seconds"""
+        return self._execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                             (time.time() - older_than,)).rowcount
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        return True  # os.kill(pid, 0) would send CTRL_C_EVENT, leave it to the lease
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    """
+    Grading jobs run by a fixed pool of worker threads in every process that called start().
+
+    There is no queue in memory: workers claim the next job from the JobStore (one question at a
+    time in turn, so a burst of submissions for one question doesn't hold up the others), and all
+    worker processes sharing the file share the queue. A claimed job is owned by its process
+    ("pid:token") under a lease the process keeps renewing. When the owner died (a restarted
+    gunicorn worker) or stopped renewing, any process puts the job back in the queue.
+    submit() raises QueueFull when max_depth jobs are already waiting. run(question_id, text)
+    does the grading and returns the result dict that is stored with the job.
+
+    Worker threads belong to the process that called start(). A queue created before a fork
+    (gunicorn preload) has to be started again in every worker process, submit() does it on first use.
+    """
+
+    def __init__(self, store: JobStore, run: Callable[[int, str], Dict], workers: int = 4,
+                 max_depth: int = 200, retention: float = 24 * 3600,
+                 lease: float = JOB_LEASE_SECONDS, poll: float = JOB_POLL_SECONDS):
+        self.store = store
+        self.run = run
+        self.workers = workers
+        self.max_depth = max_depth
+        self.retention = retention
+        self.lease = lease
+        self.poll = poll
+        # wakes an idle worker of this process when a job is submitted here
+        self._cond = threading.Condition()
+        self._started_pid = None
+        self._owner = None
+        self._next_sweep = 0.0
+
+    def __len__(self):
+        return self.store.count_queued()
+
+    def _owner_alive(self, owner: Optional[str]) -> bool:
+        if not owner:
+            return False
+        pid, _, _ = owner.partition(":")
+        if not pid.isdigit():
+            return False
+        if int(pid) == os.getpid():
+            # this process: only its current owner token, not one inherited across a fork
+            return owner == self._owner
+        return _pid_alive(int(pid))
+
+    def recover(self):
+        """Purge old jobs and requeue the ones whose process is gone. Call once at startup"""
+        self.store.purge(self.retention)
+        requeued = self.store.requeue_stale(self._owner_alive)
+        queued = len(self)
+        if queued:
+            print(f"🔁 Recovered {queued} grading jobs ({requeued} were interrupted mid-grading)")
+
+    def submit(self, question_id, text: str) -> Dict:
+        self.start()
+        depth = len(self)
+        if depth >= self.max_depth:
+            JOBS.inc(outcome="rejected")
+            raise QueueFull(f"{depth} jobs already waiting")
+        job = self.store.add(question_id, text)
+        JOBS.inc(outcome="queued")
+        with self._cond:
+            self._cond.notify()
+        return job
+
+    def start(self):
+        """Start the worker threads in this process (no-op if they are already running)"""
+        if self._started_pid == os.getpid():
+            return
+        with self._cond:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f"grading-job-{i}", daemon=True).start()
+            threading.Thread(target=self._keep_leases, args=(self._owner,), name="grading-job-lease", daemon=True).start()
+
+    def _keep_leases(self, owner: str):
+        while True:
+            time.sleep(self.lease / 3)
+            try:
+                self.store.renew(owner, self.lease)
+            except sqlite3.Error as e:
+                print(f"⚠️ Could not renew grading job leases: {e}")
+
+    def _next(self) -> Dict:
+        """Claim the next job, waiting until there is one"""
+        while True:
+            try:
+                if time.time() >= self._next_sweep:
+                    # jobs of a worker process that died don't wait for a server restart
+                    self._next_sweep = time.time() + 10 * self.poll
+                    requeued = self.store.requeue_stale(self._owner_alive)
+                    if requeued:
+                        print(f"🔁 Requeued {requeued} grading jobs of a stopped worker")
+                job = self.store.claim_next(self._owner, self.lease)
+                if job is not None:
+                    return job
+            except sqlite3.Error as e:
+                print(f"⚠️ Could not claim a grading job: {e}")
+            with self._cond:
+                self._cond.wait(self.poll)
+
+    def _work(self):
+        while True:
+            job = self._next()
+            JOB_WAIT_SECONDS.observe(time.time() - job["created_at"])
+            start = time.perf_counter()
+            try:
+                result = self.run(job["question_id"], job["text"])
+                self.store.finish(job["id"], self._owner, result)
+                JOBS.inc(outcome="done")
+            except Exception as e:
+                print(f"❌ Grading job {job['id']} failed: {e}")
+                self.store.fail(job["id"], self._owner, str(e))
+                JOBS.inc(outcome="failed")
+            finally:
+                JOB_RUN_SECONDS.observe(time.perf_counter() - start)
@@ -0,0 +1,219 @@
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from backend_health import BackendUnavailable
+from metrics import record_llm_call
+
+LLAMA_CPP_MODEL_PATH = os.environ.get("LLAMA_CPP_MODEL_PATH", "models/Meta-Llama-3-8B-Instruct.Q4_K_M.gguf")
+LLAMA_CPP_CTX = int(os.environ.get("LLAMA_CPP_CTX", 8192))
+LLAMA_CPP_THREADS = int(os.environ.get("LLAMA_CPP_THREADS", 0))
+LLAMA_CPP_GPU_LAYERS = int(os.environ.get("LLAMA_CPP_GPU_LAYERS", 0))
+# RAM for saved KV states of evaluated prompt prefixes (split instructions, feedback preamble, ...)
+LLAMA_CPP_PREFIX_CACHE_MB = int(os.environ.get("LLAMA_CPP_PREFIX_CACHE_MB", 2048))
+
+
+class LlamaCppTimeout(TimeoutError):
+    """A generation ran past its timeout and was stopped"""
+
+
+class LlamaCppClient:
+    """
+    In-process llama.cpp generation with the same interface as OllamaClient
+    (tags / generate / generate_stream returning Ollama-shaped dicts), so RobustGrader
+    can use either one.
+
+    The GGUF model stays loaded for the life of the process. KV states of evaluated prompts
+    are kept in a LlamaRAMCache: a new prompt restores the state with the longest common
+    token prefix and only evaluates the rest, so the fixed instruction block of the split
+    prompt (grader.SPLIT_INSTRUCTIONS) is evaluated once, not on every call.
+
+    One llama.cpp context runs one generation at a time, calls are serialized. A call waits
+    for the model at most its timeout (BackendUnavailable after that), and a generation still
+    running at the timeout is stopped (LlamaCppTimeout), so the breaker and latency budget of
+    backend_health.py apply as they do for Ollama.
+    The model is loaded on first use in each process (not before a gunicorn fork).
+    """
+
+    def __init__(self, model_path: str = LLAMA_CPP_MODEL_PATH, n_ctx: int = LLAMA_CPP_CTX,
+                 n_threads: int = LLAMA_CPP_THREADS, n_gpu_layers: int = LLAMA_CPP_GPU_LAYERS,
+                 prefix_cache_bytes: int = LLAMA_CPP_PREFIX_CACHE_MB * 1024 * 1024):
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.n_gpu_layers = n_gpu_layers
+        self.prefix_cache_bytes = prefix_cache_bytes
+        self.max_concurrency = 1
+        self._llama = None
+        self._lock = threading.Lock()
+
+    def _model(self):
+        """Load the model on first use. Caller holds the lock"""
+        if self._llama is None:
+            from llama_cpp import Llama, LlamaRAMCache
+
+            print(f"📦 Loading {self.model_path} into llama.cpp (n_ctx={self.n_ctx})")
+            start = time.perf_counter()
+            self._llama = Llama(
+                model_path=self.model_path,
+                n_ctx=self.n_ctx,
+                n_threads=self.n_threads or None,
+                n_gpu_layers=self.n_gpu_layers,
+                verbose=False,
+            )
+            self._llama.set_cache(LlamaRAMCache(capacity_bytes=self.prefix_cache_bytes))
+            self._load_seconds = time.perf_counter() - start
+        return self._llama
+
+    def reset(self):
+        """After fork: a llama.cpp context must not be shared with the parent, load a new one on next use"""
+        self._llama = None
+        self._lock = threading.Lock()
+
+    def tags(self, timeout: float = 5) -> Dict:
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"GGUF model not found: {self.model_path}")
+        return {"models": [{"name": os.path.basename(self.model_path)}]}
+
+    def _request(self, prompt: str, options: Dict, extra: Dict) -> Dict:
+        """Ollama generate options -> llama-cpp create_chat_completion arguments"""
+        # Ollama's /api/generate wraps the prompt in the model's chat template, so do the same
+        kwargs = {
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": options.get("temperature", 0.8),
+            "top_p": options.get("top_p", 0.95),
+            "max_tokens": options.get("num_predict") or None,
+        }
+        schema = extra.get("format")
+        if isinstance(schema, dict):
+            kwargs["response_format"] = {"type": "json_object", "schema": schema}
+        elif schema == "json":
+            kwargs["response_format"] = {"type": "json_object"}
+        return kwargs
+
+    def _stats(self, usage: Dict, start: float, first_token: Optional[float], load_seconds: float) -> Dict:
+        """Ollama-style accounting fields (durations in ns)"""
+        end = time.perf_counter()
+        first_token = first_token or end
+        return {
+            "prompt_eval_count": usage.get("prompt_tokens", 0),
+            "eval_count": usage.get("completion_tokens", 0),
+            "load_duration": int(load_seconds * 1e9),
+            "prompt_eval_duration": int((first_token - start) * 1e9),
+            "eval_duration": int((end - first_token) * 1e9),
+            "total_duration": int((end - start) * 1e9),
+        }
+
+    def _acquire(self, timeout: Optional[float]) -> Optional[float]:
+        """Wait for the model, at most timeout seconds. Returns the deadline (time.monotonic) of the call"""
+        if timeout is None:
+            self._lock.acquire()
+            return None
+        deadline = time.monotonic() + timeout
+        if not self._lock.acquire(timeout=max(timeout, 0)):
+            raise BackendUnavailable(f"llama.cpp busy with another generation for {timeout:.1f}s")
+        return deadline
+
+    def _run(self, model: str, prompt: str, options: Dict, call_site: str, extra: Dict,
+             deadline: Optional[float], on_text: Callable[[str], None],
+             stop: Optional[threading.Event] = None) -> Dict:
+        """
+        One generation. Caller holds the lock. on_text gets every piece of text as it is generated.
+        Returns the final Ollama-style chunk (done=True and the stats, empty response).
+        Raises LlamaCppTimeout once the deadline has passed, ends early when stop is set.
+        """
+        start = time.perf_counter()
+        try:
+            loaded = self._llama is not None
+            llama = self._model()
+            load_seconds = 0.0 if loaded else self._load_seconds
+            start = time.perf_counter()
+            first_token = None
+            eval_count = 0
+            chunks = llama.create_chat_completion(stream=True, **self._request(prompt, options, extra))
+            try:
+                for chunk in chunks:
+                    if stop is not None and stop.is_set():
+                        break
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise LlamaCppTimeout(f"{call_site} generation stopped at its timeout")
+                    text = chunk["choices"][0]["delta"].get("content")
+                    if not text:
+                        continue
+                    first_token = first_token or time.perf_counter()
+                    eval_count += 1
+                    on_text(text)
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
+        except Exception:
+            record_llm_call(call_site, time.perf_counter() - start, outcome="error")
+            raise
+        # streamed chat chunks carry no usage, count prompt tokens ourselves
+        prompt_tokens = len(llama.tokenize(prompt.encode('utf-8'), add_bos=False))
+        final = {"model": model, "response": "", "done": True,
+                 **self._stats({"prompt_tokens": prompt_tokens, "completion_tokens": eval_count},
+                               start, first_token, load_seconds)}
+        record_llm_call(call_site, time.perf_counter() - start, final)
+        return final
+
+    def generate(self, model: str, prompt: str, options: Dict, call_site: str = "generic",
+                 timeout: Optional[float] = 30, **extra) -> Dict:
+        """Same result shape as OllamaClient.generate. timeout covers the wait for the model and the generation"""
+        deadline = self._acquire(timeout)
+        try:
+            pieces = []
+            final = self._run(model, prompt, options, call_site, extra, deadline, pieces.append)
+        finally:
+            self._lock.release()
+        return {**final, "response": "".join(pieces)}
+
+    def generate_stream(self, model: str, prompt: str, options: Dict, call_site: str = "generic",
+                        timeout: Optional[float] = 30, **extra) -> Iterator[Dict]:
+        """
+        Same chunks as OllamaClient.generate_stream, the last one has done=True and the stats.
+        A thread generates into a queue and releases the model as soon as it is done, so a slow
+        reader of the stream doesn't hold up other generations.
+        """
+        deadline = self._acquire(timeout)
+        chunks: "queue.Queue[Tuple[str, object]]" = queue.Queue()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                final = self._run(model, prompt, options, call_site, extra, deadline,
+                                  lambda text: chunks.put(("text", text)), stop)
+                chunks.put(("done", final))
+            except Exception as e:
+                chunks.put(("error", e))
+            finally:
+                self._lock.release()
+
+        threading.Thread(target=produce, name="llama-cpp-stream", daemon=True).start()
+        try:
+            while True:
+                kind, value = chunks.get()
+                if kind == "error":
+                    raise value
+                if kind == "done":
+                    yield value
+                    return
+                yield {"model": model, "response": value, "done": False}
+        finally:
+            # the reader stopped early: let the generation end and free the model
+            stop.set()
+
+
+_client: Optional[LlamaCppClient] = None
+_client_lock = threading.Lock()
+
+
+def get_llama_cpp_client() -> LlamaCppClient:
+    """One resident model per process"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LlamaCppClient()
+        return _client
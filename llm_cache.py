@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from metrics import registry
+
+LLM_CACHE_DB = os.environ.get("LLM_CACHE_DB", "llm_cache.db")
+# call sites whose responses are cached; feedback is left out by default so students keep
+# getting freshly worded feedback, add it with LLM_CACHE_CALL_SITES=rubric,split,feedback
+LLM_CACHE_CALL_SITES = [site.strip() for site in os.environ.get("LLM_CACHE_CALL_SITES", "rubric,split").split(",") if site.strip()]
+
+LLM_CACHE_LOOKUPS = registry.counter(
+    "llm_cache_lookups_total", "LLM response cache lookups by call site (hit, miss)", ["call_site", "outcome"])
+
+
+def llm_cache_key(model: str, prompt: str, options: Dict, extra: Optional[Dict] = None) -> str:
+    payload = json.dumps({"model": model, "prompt": prompt, "options": options, "extra": extra or {}},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    Ollama responses on disk (SQLite), keyed by a hash of (model, prompt, options).
+
+    When the stored responses pass max_bytes, the least recently used ones are deleted
+    until the cache is back under 90% of the limit. The file can be shared by several
+    worker processes.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_DB, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        with self._lock:
+            conn = self._connection()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            self._bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _connection(self) -> sqlite3.Connection:
+        # an SQLite connection must not be used across fork, every process opens its own
+        if self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, result: Dict):
+        # the token context array is big and only needed to continue a conversation
+        response = json.dumps({k: v for k, v in result.items() if k != "context"}, ensure_ascii=False)
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO responses (key, response, size, last_used) VALUES (?, ?, ?, ?)",
+                         (key, response, size, time.time()))
+            self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        # other processes write to the same file, start from the real total
+        self._bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        while self._bytes > target:
+            rows = conn.execute("SELECT key, size FROM responses ORDER BY last_used LIMIT 100").fetchall()
+            if not rows:
+                break
+            conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key, _ in rows])
+            self._bytes -= sum(size for _, size in rows)
+
+    def clear(self):
+        with self._lock:
+            self._connection().execute("DELETE FROM responses")
+            self._bytes = 0
+
+
+class CachedLLMClient:
+    """
+    Wraps an OllamaClient (same generate/generate_stream interface) and answers the call
+    sites in call_sites from an LLMCache. A hit never reaches Ollama; a miss is generated
+    as usual and stored. Other call sites go straight through.
+    validators: {call_site: check of the response text}. A response that fails its call site's
+    check is still returned but not stored, so a bad reply is asked again instead of being replayed.
+    """
+
+    def __init__(self, client, cache: LLMCache, call_sites: Iterable[str] = LLM_CACHE_CALL_SITES,
+                 validators: Optional[Dict[str, Callable[[str], bool]]] = None):
+        self.client = client
+        self.cache = cache
+        self.call_sites = set(call_sites)
+        self.validators = validators or {}
+
+    def reset(self):
+        self.client.reset()
+
+    def tags(self, timeout: float = 5) -> Dict:
+        return self.client.tags(timeout=timeout)
+
+    def _lookup(self, model: str, prompt: str, options: Dict, call_site: str, extra: Dict):
+        if call_site not in self.call_sites:
+            return None, None
+        key = llm_cache_key(model, prompt, options, extra)
+        try:
+            cached = self.cache.get(key)
+        except sqlite3.Error as e:
+            print(f"⚠️ LLM cache read failed: {e}")
+            cached = None
+        LLM_CACHE_LOOKUPS.inc(call_site=call_site, outcome="hit" if cached is not None else "miss")
+        return key, cached
+
+    def _store(self, key: str, call_site: str, result: Dict):
+        validate = self.validators.get(call_site)
+        if validate is not None and not validate(result.get('response', '')):
+            print(f"⚠️ Unusable {call_site} response, not cached")
+            return
+        try:
+            self.cache.put(key, result)
+        except sqlite3.Error as e:
+            print(f"⚠️ LLM cache write failed: {e}")
+
+    def generate(self, model: str, prompt: str, options: Dict, call_site: str = "generic",
+                 timeout: Optional[float] = 30, **extra) -> Dict:
+        key, cached = self._lookup(model, prompt, options, call_site, extra)
+        if cached is not None:
+            return cached
+        result = self.client.generate(model, prompt, options, call_site=call_site, timeout=timeout, **extra)
+        if key is not None:
+            self._store(key, call_site, result)
+        return result
+
+    def generate_stream(self, model: str, prompt: str, options: Dict, call_site: str = "generic",
+                        timeout: Optional[float] = 30, **extra) -> Iterator[Dict]:
+        key, cached = self._lookup(model, prompt, options, call_site, extra)
+        if cached is not None:
+            # the whole text as one chunk
+            yield {**cached, "done": True}
+            return
+        text = []
+        for chunk in self.client.generate_stream(model, prompt, options, call_site=call_site, timeout=timeout, **extra):
+            text.append(chunk.get('response', ''))
+            if chunk.get('done') and key is not None:
+                self._store(key, call_site, {**chunk, "response": "".join(text)})
+            yield chunk
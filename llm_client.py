@@ -0,0 +1,132 @@
+import json
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from backend_health import BackendUnavailable
+from metrics import record_llm_call
+
+
+class OllamaError(Exception):
+    """Ollama answered with a non-200 status"""
+
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"HTTP {status_code}: {body[:200]}")
+        self.status_code = status_code
+        self.body = body
+
+
+class OllamaClient:
+    """
+    HTTP client for one Ollama server.
+
+    Uses a pooled requests.Session, so calls reuse keep-alive connections instead of
+    opening a new one each time, and caps the number of generate calls in flight at
+    max_concurrency (extra callers wait for a slot). Shared by every grader and thread
+    in the process, see get_client().
+
+    timeout covers the whole call: the wait for a slot comes out of it, and a call that
+    gets no slot in time raises BackendUnavailable without reaching Ollama.
+    """
+
+    def __init__(self, base_url: str, max_concurrency: int = 4):
+        self.base_url = base_url.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency + 2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def reset(self):
+        """Drop pooled connections, e.g. in a worker process forked from a parent that used them"""
+        self.session.close()
+
+    def _acquire(self, timeout: Optional[float]) -> Optional[float]:
+        """Wait for a generate slot, returns what is left of timeout for the HTTP call"""
+        if timeout is None:
+            self._slots.acquire()
+            return None
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=max(timeout, 0)):
+            raise BackendUnavailable(f"no free Ollama slot within {timeout:.1f}s ({self.max_concurrency} calls in flight)")
+        return max(timeout - (time.monotonic() - start), 0.001)
+
+    def tags(self, timeout: float = 5) -> Dict:
+        response = self.session.get(f"{self.base_url}/api/tags", timeout=timeout)
+        if response.status_code != 200:
+            raise OllamaError(response.status_code, response.text)
+        return response.json()
+
+    def generate(self, model: str, prompt: str, options: Dict, call_site: str = "generic",
+                 timeout: Optional[float] = 30, **extra) -> Dict:
+        """Non-streaming /api/generate. Returns Ollama's JSON (response text, token counts, durations)"""
+        data = {"model": model, "prompt": prompt, "stream": False, "options": options, **extra}
+        timeout = self._acquire(timeout)
+        try:
+            start = time.perf_counter()
+            try:
+                response = self.session.post(f"{self.base_url}/api/generate", json=data, timeout=timeout)
+            except Exception:
+                record_llm_call(call_site, time.perf_counter() - start, outcome="error")
+                raise
+            if response.status_code != 200:
+                record_llm_call(call_site, time.perf_counter() - start, outcome="http_error")
+                raise OllamaError(response.status_code, response.text)
+            result = response.json()
+            record_llm_call(call_site, time.perf_counter() - start, result)
+            return result
+        finally:
+            self._slots.release()
+
+    def generate_stream(self, model: str, prompt: str, options: Dict, call_site: str = "generic",
+                        timeout: Optional[float] = 30, **extra) -> Iterator[Dict]:
+        """Streaming /api/generate. Yields Ollama's chunks, the last one has done=True and the stats"""
+        data = {"model": model, "prompt": prompt, "stream": True, "options": options, **extra}
+        timeout = self._acquire(timeout)
+        try:
+            start = time.perf_counter()
+            try:
+                with self.session.post(f"{self.base_url}/api/generate", json=data, stream=True, timeout=timeout) as response:
+                    if response.status_code != 200:
+                        record_llm_call(call_site, time.perf_counter() - start, outcome="http_error")
+                        raise OllamaError(response.status_code, response.text)
+                    # Ollama streams one JSON object per line
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        yield chunk
+                        if chunk.get('done'):
+                            record_llm_call(call_site, time.perf_counter() - start, chunk)
+                            return
+            except OllamaError:
+                raise
+            except Exception:
+                record_llm_call(call_site, time.perf_counter() - start, outcome="error")
+                raise
+        finally:
+            self._slots.release()
+
+
+_clients: Dict[str, OllamaClient] = {}
+_clients_lock = threading.Lock()
+
+
+def reset_clients():
+    """Call after fork: sockets opened by the parent must not be shared with the children"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.reset()
+
+
+def get_client(base_url: str, max_concurrency: int = 4) -> OllamaClient:
+    """One client (connection pool + concurrency limit) per Ollama server per process"""
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = OllamaClient(base_url, max_concurrency)
+        return client
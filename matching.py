@@ -0,0 +1,131 @@
+import os
+from typing import List
+
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment  # optional, the numpy version below is used without it
+except ImportError:
+    linear_sum_assignment = None
+
+# "mutual_best": a student part scores when it and an answer key part are each other's best match
+# "hungarian":   one-to-one assignment with the highest total similarity, better for rubrics with many parts
+PART_MATCHING_METHODS = ("mutual_best", "hungarian")
+PART_MATCHING = os.environ.get("PART_MATCHING", "mutual_best")
+# a matched pair must be more similar than this to score
+MATCH_THRESHOLD = 0.7
+# one-part answer key answered in one part: full points above this similarity
+SINGLE_PART_THRESHOLD = 0.8
+
+# stands in for padding (-inf) in the assignment, far below any cosine similarity
+_PADDING_SIMILARITY = -1e6
+
+
+def stack_similarities(matrices: List[np.ndarray]) -> np.ndarray:
+    """
+    (student parts x answer key parts) matrices of different sizes -> one (batch, max rows, max cols)
+    tensor, padded with -inf. Padding never matches anything.
+    """
+    rows = max(matrix.shape[0] for matrix in matrices)
+    cols = max(matrix.shape[1] for matrix in matrices)
+    stacked = np.full((len(matrices), rows, cols), -np.inf, dtype=np.float32)
+    for i, matrix in enumerate(matrices):
+        stacked[i, :matrix.shape[0], :matrix.shape[1]] = matrix
+    return stacked
+
+
+def mutual_best_matches(similarities: np.ndarray, threshold: float = MATCH_THRESHOLD) -> np.ndarray:
+    """
+    Matched answer key part per student part (-1 for none) for a (students, keys) matrix
+    or a (batch, students, keys) tensor, in one pass: student part i matches key part j when j is
+    the best key for i, i is the best student for j and their similarity is above threshold.
+    """
+    similarities = np.asarray(similarities)
+    row_best = np.argmax(similarities, axis=-1)
+    row_value = np.take_along_axis(similarities, row_best[..., None], axis=-1)[..., 0]
+    col_best = np.argmax(similarities, axis=-2)
+    mutual = np.take_along_axis(col_best, row_best, axis=-1) == np.arange(similarities.shape[-2])
+    return np.where(mutual & (row_value > threshold), row_best, -1)
+
+
+def _assignment(cost: np.ndarray):
+    """
+    Minimum cost assignment of every row of cost (rows <= cols) to a distinct column, the
+    shortest augmenting path form of the Hungarian algorithm, O(rows^2 * cols).
+    Returns the column of each row.
+    """
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    # row assigned to column j (1-based, 0 = none), column 0 is the row being inserted
+    p = np.zeros(m + 1, dtype=int)
+    way = np.zeros(m + 1, dtype=int)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    columns = np.full(n, -1, dtype=int)
+    for j in range(1, m + 1):
+        if p[j]:
+            columns[p[j] - 1] = j - 1
+    return columns
+
+
+def _optimal_matches_2d(similarities: np.ndarray, threshold: float) -> np.ndarray:
+    scores = np.where(np.isfinite(similarities), similarities, _PADDING_SIMILARITY).astype(np.float64)
+    matches = np.full(scores.shape[0], -1, dtype=int)
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(scores, maximize=True)
+    elif scores.shape[0] <= scores.shape[1]:
+        rows = np.arange(scores.shape[0])
+        cols = _assignment(-scores)
+    else:
+        cols = np.arange(scores.shape[1])
+        rows = _assignment(-scores.T)
+    keep = scores[rows, cols] > threshold
+    matches[rows[keep]] = cols[keep]
+    return matches
+
+
+def optimal_matches(similarities: np.ndarray, threshold: float = MATCH_THRESHOLD) -> np.ndarray:
+    """
+    Same result shape as mutual_best_matches, from the one-to-one assignment of student parts
+    to answer key parts with the highest total similarity. Assigned pairs at or below threshold
+    don't match. Uses scipy when it is installed.
+    """
+    similarities = np.asarray(similarities)
+    if similarities.ndim == 2:
+        return _optimal_matches_2d(similarities, threshold)
+    return np.stack([_optimal_matches_2d(matrix, threshold) for matrix in similarities])
+
+
+def match_parts(similarities: np.ndarray, method: str = PART_MATCHING, threshold: float = MATCH_THRESHOLD) -> np.ndarray:
+    """Matched answer key part per student part (-1 for none), 2-D or batched 3-D"""
+    if method == "hungarian":
+        return optimal_matches(similarities, threshold)
+    if method != "mutual_best":
+        raise ValueError(f"Unknown part matching {method!r}, expected one of {PART_MATCHING_METHODS}")
+    return mutual_best_matches(similarities, threshold)
@@ -0,0 +1,182 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+# Prometheus text exposition, without the prometheus_client dependency.
+# Metrics are per process.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return "\n".join(lines)
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> str:
+        return super().render().replace(f"# TYPE {self.name} counter", f"# TYPE {self.name} gauge", 1)
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+                labels = _format_labels(self.labelnames, key)
+                inf = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{inf} {state[-1]}")
+                lines.append(f"{self.name}_sum{labels} {state[-2]}")
+                lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return "\n".join(lines)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            # modules can be imported twice (e.g. by the Flask reloader), keep the first one
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "grader_stage_seconds", "Time spent in each grading stage", ["stage"])
+STAGE_ERRORS = registry.counter(
+    "grader_stage_errors_total", "Grading stages that raised", ["stage"])
+SPLIT_STRATEGY = registry.counter(
+    "grader_split_total", "Answer splits by strategy (rule-based segmenter or LLM)", ["strategy"])
+SPLIT_PARSE = registry.counter(
+    "grader_split_parse_total", "LLM split responses by how they parsed (json, repaired, failed)", ["outcome"])
+SINGLE_PASS = registry.counter(
+    "grader_single_pass_total", "Single-pass gradings (ok, or fallback to the multi-call pipeline)", ["outcome"])
+
+LLM_REQUEST_SECONDS = registry.histogram(
+    "llm_request_seconds", "Wall time of Ollama /api/generate calls", ["call_site"])
+LLM_REQUESTS = registry.counter(
+    "llm_requests_total", "Ollama /api/generate calls by outcome", ["call_site", "outcome"])
+LLM_PROMPT_TOKENS = registry.counter(
+    "llm_prompt_tokens_total", "Prompt tokens evaluated (prompt_eval_count)", ["call_site"])
+LLM_EVAL_TOKENS = registry.counter(
+    "llm_eval_tokens_total", "Tokens generated (eval_count)", ["call_site"])
+LLM_EVAL_SECONDS = registry.histogram(
+    "llm_eval_seconds", "Generation time reported by Ollama (eval_duration)", ["call_site"])
+LLM_LOAD_SECONDS = registry.histogram(
+    "llm_load_seconds", "Model load time reported by Ollama (load_duration)", ["call_site"])
+
+EMBED_BATCH_SIZE = registry.histogram(
+    "embedding_batch_size", "Texts per encode call", ["model"], buckets=SIZE_BUCKETS)
+EMBED_SECONDS = registry.histogram(
+    "embedding_encode_seconds", "Time per encode call", ["model"])
+
+HTTP_REQUESTS = registry.counter(
+    "http_requests_total", "HTTP requests by route and status", ["route", "status"])
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_seconds", "HTTP request latency by route", ["route"])
+
+
+@contextmanager
+def span(stage: str):
+    """Time a grading stage: with span("rubric"): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def record_llm_call(call_site: str, seconds: float, result: Optional[Dict] = None, outcome: str = "ok"):
+    """Record one Ollama call. result is the (final) JSON object Ollama returned, durations are in ns"""
+    LLM_REQUEST_SECONDS.observe(seconds, call_site=call_site)
+    LLM_REQUESTS.inc(call_site=call_site, outcome=outcome)
+    if not result:
+        return
+    LLM_PROMPT_TOKENS.inc(result.get("prompt_eval_count", 0), call_site=call_site)
+    LLM_EVAL_TOKENS.inc(result.get("eval_count", 0), call_site=call_site)
+    if "eval_duration" in result:
+        LLM_EVAL_SECONDS.observe(result["eval_duration"] / 1e9, call_site=call_site)
+    if "load_duration" in result:
+        LLM_LOAD_SECONDS.observe(result["load_duration"] / 1e9, call_site=call_site)
+
+
+def record_encode(model: str, batch_size: int, seconds: float):
+    EMBED_BATCH_SIZE.observe(batch_size, model=model)
+    EMBED_SECONDS.observe(seconds, model=model)
@@ -0,0 +1,60 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+from embedding_backends import EMBEDDING_BACKEND, load_embedding_model
+
+
+DEFAULT_EMBEDDING_MODEL = "MPA/sambert"
+
+# Short Hebrew sentence used to push the model through one full encode at startup
+WARMUP_TEXT = "בדיקת חימום של מודל ההטמעה"
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of embedding models.
+    Each (model name, device, backend) is loaded once and shared by every grader.
+    backend picks how the model runs, see embedding_backends.py.
+    """
+
+    def __init__(self):
+        self._models: Dict[Tuple[str, Optional[str], str], object] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name: str = DEFAULT_EMBEDDING_MODEL, device: Optional[str] = None,
+            backend: str = EMBEDDING_BACKEND):
+        """Return the loaded model, loading it on first use"""
+        key = (model_name, device, backend)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            # another thread may have loaded it while we waited
+            model = self._models.get(key)
+            if model is None:
+                print(f"📦 Loading embedding model {model_name} (device={device or 'auto'}, backend={backend})")
+                model = load_embedding_model(model_name, device, backend)
+                self._models[key] = model
+        return model
+
+    def register(self, model, model_name: str = DEFAULT_EMBEDDING_MODEL, device: Optional[str] = None,
+                 backend: str = EMBEDDING_BACKEND):
+        """Use an already constructed model (anything with .encode) for this name, e.g. a small local model in benchmarks"""
+        with self._lock:
+            self._models[(model_name, device, backend)] = model
+
+    def warmup(self, model_name: str = DEFAULT_EMBEDDING_MODEL, device: Optional[str] = None,
+               backend: str = EMBEDDING_BACKEND):
+        """Load the model and run one encode so the first real request is not the slow one"""
+        model = self.get(model_name, device, backend)
+        model.encode([WARMUP_TEXT])
+        print(f"🔥 Embedding model {model_name} warmed up")
+        return model
+
+    def loaded(self):
+        return list(self._models.keys())
+
+
+# shared by backend.py and anything else running in this process
+default_registry = ModelRegistry()
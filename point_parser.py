@@ -0,0 +1,131 @@
+import json
+import re
+from typing import List, Optional, Tuple
+
+# '{"point1": "' or ', "point2": "' - the start of one value in [{"pointN": "..."}, ...].
+# Keys are short and quote-free, so the bounded {1,40} keeps the search linear in the text.
+_KEY_PATTERN = re.compile(r'[{,]\s*"([^"\n]{1,40})"\s*:\s*"')
+# what may follow the closing quote of a value
+_VALUE_TAIL = " \t\r\n{},]"
+# the closing quote of the last value: a quote followed by } or ], anything after it is not part of the value
+_LAST_VALUE_END = re.compile(r'"\s*[}\]]')
+
+# JSON schema for Ollama structured output (the `format` field of /api/generate)
+POINTS_SCHEMA = {
+    "type": "object",
+    "properties": {"points": {"type": "array", "items": {"type": "string"}}},
+    "required": ["points"],
+}
+
+# single-pass grading: the student text for each answer key part, and feedback for each part
+GRADED_PARTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "segments": {"type": "array", "items": {"type": "string"}},
+        "feedback": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["segments", "feedback"],
+}
+
+
+def _values(data) -> Optional[List[str]]:
+    """Point texts from parsed JSON: [{"point1": "..."}, ...] or {"points": ["...", ...]}"""
+    if isinstance(data, dict) and isinstance(data.get("points"), list):
+        data = data["points"]
+    if not isinstance(data, list):
+        return None
+    values = []
+    for item in data:
+        if isinstance(item, dict):
+            values.extend(str(value) for value in item.values())
+        elif isinstance(item, str):
+            values.append(item)
+    return values
+
+
+def _unescape(raw: str) -> str:
+    try:
+        return json.loads(f'"{raw}"')
+    except json.JSONDecodeError:
+        # unescaped quotes or a dangling backslash, undo the common escapes by hand
+        return raw.replace('\\n', '\n').replace('\\"', '"').replace('\\\\', '\\')
+
+
+def _scan(text: str) -> List[str]:
+    """
+    One pass over the text: every value runs from its key to the next key (or the end).
+    Quotes inside a value don't matter, and a value cut off by truncation is kept as is.
+    """
+    keys = list(_KEY_PATTERN.finditer(text))
+    values = []
+    for i, key in enumerate(keys):
+        end = keys[i + 1].start() if i + 1 < len(keys) else len(text)
+        raw = text[key.end():end]
+        if i + 1 == len(keys):
+            # anything the model wrote after the closing bracket (even with braces in it) is not part of the value
+            close = _LAST_VALUE_END.search(raw)
+            if close:
+                raw = raw[:close.start() + 1]
+        # drop the closing quote and the }, ] that follow it
+        raw = raw.rstrip(_VALUE_TAIL)
+        if raw.endswith('"'):
+            raw = raw[:-1]
+        values.append(_unescape(raw).strip())
+    return values
+
+
+def parse_points(text: str) -> Tuple[Optional[List[str]], str]:
+    """
+    Point texts from an LLM split response, and how they were recovered:
+    "json" when the response was valid JSON, "repaired" when it needed the tolerant scan
+    (text around the JSON, unescaped quotes, missing brackets, truncated output), "failed" when nothing was found.
+    Runs in time linear in the length of the response.
+    """
+    text = text.strip()
+    try:
+        values = _values(json.loads(text))
+        if values:
+            return values, "json"
+    except json.JSONDecodeError:
+        pass
+
+    # valid JSON with text around it: the first complete array or object, whatever follows it
+    decoder = json.JSONDecoder()
+    for start in sorted(i for i in (text.find('['), text.find('{')) if i >= 0):
+        try:
+            values = _values(decoder.raw_decode(text, start)[0])
+        except json.JSONDecodeError:
+            continue
+        if values:
+            return values, "repaired"
+
+    values = _scan(text)
+    if values:
+        return values, "repaired"
+    return None, "failed"
+
+
+def parse_graded_parts(text: str, num_parts: int) -> Optional[Tuple[List[str], List[str]]]:
+    """
+    (segments, feedback) from a single-pass grading response, both num_parts long
+    (padded with "" or cut), or None when the response is not the expected JSON object.
+    Text around the outermost braces is ignored.
+    """
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end < start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    columns = []
+    for field in ("segments", "feedback"):
+        values = data.get(field)
+        if not isinstance(values, list):
+            return None
+        values = [value.strip() if isinstance(value, str) else "" for value in values[:num_parts]]
+        columns.append(values + [""] * (num_parts - len(values)))
+    return columns[0], columns[1]
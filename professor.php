@@ -15,7 +15,25 @@ function loadQuestions() {
 // Function to save questions to JSON file
 function saveQuestions($questions) {
     $jsonData = json_encode($questions, JSON_PRETTY_PRINT | JSON_UNESCAPED_UNICODE);
-    file_put_contents('course_work.json', $jsonData);
+    // write a temp file and rename it over the original, so the backend never reads a half-written file
+    $tmpFile = 'course_work.json.tmp';
+    file_put_contents($tmpFile, $jsonData);
+    rename($tmpFile, 'course_work.json');
+}
+
+// Ask the grading backend to precompute rubric analysis and answer key split for a question.
+// Fire and forget: if the backend is down the artifacts are built on the first submission instead.
+function prepareGradingArtifacts($id) {
+    $context = stream_context_create([
+        'http' => [
+            'method' => 'POST',
+            'header' => "Content-Type: application/json\r\n",
+            'content' => '{}',
+            'timeout' => 2,
+            'ignore_errors' => true
+        ]
+    ]);
+    @file_get_contents("http://localhost:5050/questions/$id/artifacts", false, $context);
 }
 
 // Function to get the next ID
@@ -40,6 +58,7 @@ if ($_SERVER['REQUEST_METHOD'] === 'POST') {
         $questions = $_POST['questions'] ?? '';
         $answer = $_POST['answer'] ?? '';
         $rubric = $_POST['rubric'] ?? '';
+        $gradingMode = ($_POST['grading_mode'] ?? '') === 'single_pass' ? 'single_pass' : 'pipeline';
         
         if (!empty($text) && !empty($questions)) {
             $newId = getNextId($allQuestions);
@@ -48,11 +67,13 @@ if ($_SERVER['REQUEST_METHOD'] === 'POST') {
                 'text' => $text,
                 'questions' => $questions,
                 'answer' => $answer,
-                'rubric' => $rubric
+                'rubric' => $rubric,
+                'grading_mode' => $gradingMode
             ];
             
             $allQuestions[] = $newQuestion;
             saveQuestions($allQuestions);
+            prepareGradingArtifacts($newId);
             $message = "Question #$newId added successfully!";
         } else {
             $message = "Error: Text and Question fields are required.";
@@ -177,6 +198,14 @@ if ($_SERVER['REQUEST_METHOD'] === 'POST') {
                                         <textarea class="form-control rtl-text" id="rubric" name="rubric" rows="4"></textarea>
                                     </div>
                                     
+                                    <div class="mb-3">
+                                        <label for="grading_mode" class="form-label">Grading Mode:</label>
+                                        <select class="form-select" id="grading_mode" name="grading_mode">
+                                            <option value="pipeline" selected>Standard (split, score, then feedback)</option>
+                                            <option value="single_pass">Single pass (one LLM call per answer)</option>
+                                        </select>
+                                    </div>
+                                    
                                     <div class="d-grid gap-2 d-md-flex justify-content-md-end">
                                         <button type="submit" name="add_question" class="btn btn-primary">Add Question</button>
                                     </div>
@@ -241,6 +270,12 @@ if ($_SERVER['REQUEST_METHOD'] === 'POST') {
                                                                 </div>
                                                             <?php endif; ?>
                                                             
+                                                            <?php if (($question['grading_mode'] ?? 'pipeline') === 'single_pass'): ?>
+                                                                <div class="mb-3">
+                                                                    <span class="badge bg-info">Single-pass grading</span>
+                                                                </div>
+                                                            <?php endif; ?>
+                                                            
                                                         </div>
                                                     </div>
                                                 </div>
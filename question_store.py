@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class QuestionStore:
+    """
+    course_work.json indexed by question id, reloaded when the file changes on disk.
+
+    professor.php edits the file while the server runs, so every lookup checks the file's
+    mtime/size (at most once per check_interval seconds) and rebuilds the index if it changed.
+    The index is rebuilt off to the side and swapped in as one object, so readers always see
+    either the old or the new set of questions. A file that fails to parse (caught mid-write)
+    is ignored and the previous index keeps serving until the next check.
+    """
+
+    def __init__(self, path: str = 'course_work.json', check_interval: float = 0.5):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[List], None]] = []
+        self._last_check = 0.0
+        # (file signature, {id: question}, [questions in file order])
+        self._snapshot = (None, {}, [])
+        self.refresh(force=True)
+
+    def on_change(self, callback: Callable[[List], None]):
+        """Register callback(changed_ids), called after a reload changed, added or removed questions"""
+        self._listeners.append(callback)
+
+    def get(self, question_id) -> Optional[Dict]:
+        self.refresh()
+        return self._snapshot[1].get(question_id)
+
+    def all(self) -> List[Dict]:
+        self.refresh()
+        return self._snapshot[2]
+
+    def __len__(self):
+        return len(self._snapshot[2])
+
+    @property
+    def loaded(self) -> bool:
+        """True once the file has been read and parsed"""
+        return self._snapshot[0] is not None
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def refresh(self, force: bool = False) -> bool:
+        """Reload the file if it changed since the last load. Returns True if the index was replaced"""
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+
+        signature = self._signature()
+        if signature == self._snapshot[0] and not force:
+            return False
+
+        with self._lock:
+            old_signature, old_index, _ = self._snapshot
+            if signature == old_signature and not force:
+                # another thread reloaded it while we waited
+                return False
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    questions = json.load(f)
+            except FileNotFoundError:
+                questions = []
+            except Exception as e:
+                print(f"⚠️ Could not reload {self.path}, keeping {len(old_index)} cached questions: {e}")
+                return False
+
+            index = {item.get('id'): item for item in questions}
+            self._snapshot = (signature, index, questions)
+
+        changed = [qid for qid in set(old_index) | set(index) if old_index.get(qid) != index.get(qid)]
+        if changed:
+            print(f"🔄 Reloaded {self.path}: {len(index)} questions, changed {sorted(changed, key=str)}")
+            for callback in self._listeners:
+                try:
+                    callback(changed)
+                except Exception as e:
+                    print(f"⚠️ Question change listener failed: {e}")
+        return True
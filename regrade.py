@@ -0,0 +1,286 @@
+"""
+Offline bulk regrade of a JSONL file of submissions, e.g. after a rubric, answer key or model change.
+
+Input:  one {"submission_id": ..., "question_id": ..., "text": "..."} object per line
+Output: one /process style result per line, plus submission_id and what it was graded against
+
+The input is indexed in one streaming pass (byte offsets, no answer texts kept in memory) and
+grouped by question, so every question's artifacts are built once, in the parent process, before
+the worker pool is forked. The workers share the parent's embedding model copy-on-write (as under
+serve.py) and grade chunks of same-question submissions with grade_batch.
+
+Results are appended to the output file as every chunk finishes (flushed and fsynced), so the
+output is also the checkpoint. Running the same command again skips submissions that already
+have a result graded against the current question content and models. Errors, degraded results
+(LLM unavailable) and results of changed questions are dropped from the file and graded again.
+
+usage:
+    python regrade.py submissions.jsonl                       # -> submissions.regraded.jsonl
+    python regrade.py submissions.jsonl -o out.jsonl --workers 4 --chunk-size 32
+    python regrade.py submissions.jsonl --no-feedback          # scores only, no feedback LLM call
+    python regrade.py submissions.jsonl --restart              # ignore earlier results
+"""
+import argparse
+import contextvars
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Set, Tuple
+
+# LLM calls in flight per worker process
+LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", 4))
+
+# set in the parent before the pool is forked, inherited by the workers
+_state: Dict = {}
+
+
+def index_submissions(path: str) -> Tuple["OrderedDict[object, List[Tuple[str, int]]]", List[Dict]]:
+    """
+    One pass over the input: {question_id: [(submission_id, byte offset), ...]} in file order,
+    and error records for lines that can't be graded. Answer texts are read again by the workers.
+    """
+    groups: "OrderedDict[object, List[Tuple[str, int]]]" = OrderedDict()
+    errors = []
+    seen = set()
+    with open(path, 'rb') as f:
+        line_number = 0
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                errors.append({"submission_id": f"line-{line_number}", "status": "error", "response": f"Invalid JSON: {e}"})
+                continue
+            # without an id, the line number identifies the submission (stable as long as the file is)
+            submission_id = str(record.get('submission_id', f"line-{line_number}"))
+            if submission_id in seen:
+                print(f"⚠️ Duplicate submission_id {submission_id} on line {line_number}, skipped")
+                continue
+            seen.add(submission_id)
+            if 'text' not in record:
+                errors.append({"submission_id": submission_id, "question_id": record.get('question_id'),
+                               "status": "error", "response": "No text received"})
+                continue
+            groups.setdefault(record.get('question_id', 1), []).append((submission_id, offset))
+    return groups, errors
+
+
+def load_checkpoint(path: str, current: Dict[object, str], models: List[str]) -> Set[str]:
+    """
+    submission_ids with a usable result in the output file. Anything else (a line cut off by an
+    interrupted write, errors, degraded results, results for an old question version or old
+    models) is dropped from the file, so those submissions are graded again.
+    """
+    if not os.path.exists(path):
+        return set()
+
+    done = set()
+    kept = []
+    dropped = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line) if line.endswith('\n') else None
+            except json.JSONDecodeError:
+                result = None
+            if (result is None or result.get('status') != 'success' or result.get('degraded')
+                    or result.get('question_hash') != current.get(result.get('question_id'))
+                    or result.get('models') != models):
+                dropped += 1
+                continue
+            done.add(str(result['submission_id']))
+            kept.append(line)
+
+    if dropped:
+        # rewrite without them, replace in one step so an interruption keeps the old file
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            f.writelines(kept)
+        os.replace(path + ".tmp", path)
+    print(f"📌 Checkpoint {path}: {len(done)} results kept, {dropped} to grade again")
+    return done
+
+
+def chunks(groups, done: Set[str], chunk_size: int) -> Iterator[Tuple[object, List[Tuple[str, int]]]]:
+    """(question_id, up to chunk_size submissions) of every question, skipping finished submissions"""
+    for question_id, submissions in groups.items():
+        pending = [submission for submission in submissions if submission[0] not in done]
+        for start in range(0, len(pending), chunk_size):
+            yield question_id, pending[start:start + chunk_size]
+
+
+def _init_worker(threads: int):
+    """Runs in every forked worker: own connections and threads, a share of the CPU for torch"""
+    import llm_client
+
+    llm_client.reset_clients()
+    _state["grader"].after_fork()
+    if threads and "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+
+
+def grade_chunk(task: Tuple[object, List[Tuple[str, int]]]) -> List[Dict]:
+    """Grade one chunk of same-question submissions, returns one output record per submission"""
+    from backend_health import latency_budget
+    from grader import question_grading_mode
+
+    question_id, submissions = task
+    grader = _state["grader"]
+    question = _state["questions"][question_id]
+    artifacts = _state["artifacts"].get(question_id)
+    mode = question_grading_mode(question)
+
+    texts = []
+    with open(_state["input"], 'rb') as f:
+        for _, offset in submissions:
+            f.seek(offset)
+            texts.append(json.loads(f.readline())['text'])
+
+    try:
+        # no time limit, the budget only records whether an LLM call was skipped or failed
+        with latency_budget(float("inf")) as budget:
+            results = grader.grade_batch(
+                [(question['rubric'], question['answer'], text, artifacts, mode) for text in texts],
+                max_workers=_state["llm_concurrency"])
+            if _state["feedback"]:
+                with ThreadPoolExecutor(max_workers=_state["llm_concurrency"]) as pool:
+                    futures = [pool.submit(contextvars.copy_context().run, grader._feedback, result) for result in results]
+                    feedbacks = [future.result() for future in futures]
+            else:
+                feedbacks = [None] * len(results)
+    except Exception as e:
+        print(f"❌ Error grading question {question_id}: {e}")
+        return [{"submission_id": submission_id, "question_id": question_id, "status": "error",
+                 "response": f"Grading error: {e}"} for submission_id, _ in submissions]
+
+    records = []
+    for (submission_id, _), result, feedback in zip(submissions, results, feedbacks):
+        records.append({
+            "submission_id": submission_id,
+            "question_id": question_id,
+            "status": "success",
+            **result.to_dict(),
+            "feedback": feedback,
+            # per chunk: one failed LLM call marks the whole chunk, it is graded again on resume
+            "degraded": budget.degraded or result.rubric_method == "fallback",
+            "grading_mode": result.grading_mode,
+            "question_hash": _state["question_hashes"][question_id],
+            "models": _state["models"],
+        })
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regrade a JSONL file of submissions")
+    parser.add_argument("input", help="JSONL with submission_id, question_id and text per line")
+    parser.add_argument("-o", "--output", default=None, help="results JSONL, also the checkpoint (default <input>.regraded.jsonl)")
+    parser.add_argument("--questions", default="course_work.json")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="grading processes")
+    parser.add_argument("--chunk-size", type=int, default=16, help="submissions of one question per grade_batch call")
+    parser.add_argument("--llm-concurrency", type=int, default=LLM_CONCURRENCY, help="LLM calls in flight per worker")
+    parser.add_argument("--no-feedback", action="store_true", help="skip the feedback LLM call")
+    parser.add_argument("--restart", action="store_true", help="discard earlier results in the output file")
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.splitext(args.input)[0] + ".regraded.jsonl"
+    if args.restart and os.path.exists(output):
+        os.remove(output)
+
+    from artifacts import ArtifactStore, question_content_hash
+    from embedding_backends import embedding_model_id
+    from embedding_cache import EmbeddingCache
+    from grader import RobustGrader
+    from llm_cache import LLMCache
+    from model_registry import default_registry, DEFAULT_EMBEDDING_MODEL
+    from question_store import QuestionStore
+
+    question_store = QuestionStore(args.questions)
+    questions = {question.get('id'): question for question in question_store.all()}
+    embedding_cache = EmbeddingCache(embedding_model_id(DEFAULT_EMBEDDING_MODEL))
+    llm_cache = LLMCache(max_bytes=int(os.environ.get("LLM_CACHE_MB", 256)) * 1024 * 1024)
+    grader = RobustGrader(model_registry=default_registry, embedding_cache=embedding_cache, llm_cache=llm_cache)
+    models = [grader.model_name, grader.embedding_model_id]
+    question_hashes = {question_id: question_content_hash(question) for question_id, question in questions.items()}
+
+    start = time.perf_counter()
+    groups, errors = index_submissions(args.input)
+    total = sum(len(submissions) for submissions in groups.values()) + len(errors)
+    print(f"📥 {total} submissions for {len(groups)} questions in {args.input}")
+
+    done = load_checkpoint(output, question_hashes, models)
+    # questions that can't be graded: every submission gets an error record
+    for question_id in list(groups):
+        question = questions.get(question_id)
+        reason = None
+        if question is None:
+            reason = f"Question ID {question_id} not found"
+        elif not question.get('rubric') or not question.get('answer'):
+            reason = "Missing rubric or answer key for this question"
+        if reason:
+            errors.extend({"submission_id": submission_id, "question_id": question_id, "status": "error",
+                           "response": reason} for submission_id, _ in groups.pop(question_id))
+
+    pending = sum(1 for submissions in groups.values() for submission_id, _ in submissions if submission_id not in done)
+    print(f"🔁 {pending} to grade, {len(done)} already done")
+
+    # shared by every worker: the model is loaded and artifacts are built here, before the fork
+    print("📦 Loading embedding model and building artifacts")
+    if grader.similarity_model is None:
+        print("❌ Embedding model not available, aborting")
+        return 1
+    artifact_store = ArtifactStore()
+    _state.update(
+        grader=grader,
+        questions=questions,
+        question_hashes=question_hashes,
+        artifacts={question_id: artifact_store.get_or_build(questions[question_id], grader) for question_id in groups},
+        models=models,
+        input=args.input,
+        feedback=not args.no_feedback,
+        llm_concurrency=args.llm_concurrency,
+    )
+
+    graded = failed = 0
+    with open(output, 'a', encoding='utf-8') as out:
+        def write(records):
+            for record in records:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+
+        write(errors)
+        failed += len(errors)
+
+        threads = max(1, (os.cpu_count() or 1) // args.workers)
+        # fork: the workers get the loaded model and artifacts without pickling or reloading them
+        pool = multiprocessing.get_context("fork").Pool(args.workers, initializer=_init_worker, initargs=(threads,))
+        try:
+            for records in pool.imap_unordered(grade_chunk, chunks(groups, done, args.chunk_size)):
+                write(records)
+                graded += sum(record['status'] == 'success' for record in records)
+                failed += sum(record['status'] != 'success' for record in records)
+                print(f"   ✅ {graded}/{pending} graded, {failed} errors")
+            pool.close()
+        except KeyboardInterrupt:
+            print(f"\n⏸️ Interrupted, {graded} results saved. Run the same command again to resume")
+            pool.terminate()
+            return 130
+        finally:
+            pool.join()
+
+    elapsed = time.perf_counter() - start
+    print(f"🏁 {graded} graded, {failed} errors in {elapsed:.1f}s -> {output}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
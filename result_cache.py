@@ -0,0 +1,116 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from artifacts import question_content_hash
+from embedding_cache import normalize_text
+from metrics import registry
+
+RESULT_CACHE_LOOKUPS = registry.counter(
+    "result_cache_lookups_total", "Grading result cache lookups (hit, coalesced, miss)", ["outcome"])
+
+
+def result_key(question: Dict, student_answer: str, model_versions: Tuple[str, ...]) -> Tuple:
+    """(question id, question content hash, normalized answer hash, models that produced the result)"""
+    answer_hash = hashlib.sha256(normalize_text(student_answer).encode('utf-8')).hexdigest()
+    return (question.get('id'), question_content_hash(question), answer_hash, model_versions)
+
+
+class LeaderGone(Exception):
+    """The request grading for the waiters stopped before it had a result (e.g. a closed stream)"""
+
+
+class ResultCache:
+    """
+    Finished /process responses, keyed by question, student answer and model versions.
+
+    Answers are compared after normalize_text, so a resubmission that only differs in whitespace
+    or unicode form is a hit. Entries expire after ttl seconds and the oldest are dropped past
+    max_entries. Identical requests that arrive while the first one is still grading wait for
+    its result instead of grading again (single-flight); failures are not cached.
+    """
+
+    def __init__(self, max_entries: int = 10_000, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (expires at, response)
+        self._entries: "OrderedDict[Tuple, Tuple[float, Dict]]" = OrderedDict()
+        self._in_flight: Dict[Tuple, Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def begin(self, key: Tuple) -> Tuple[Optional[Dict], Optional[Future], bool]:
+        """
+        Start a lookup: (cached response, None, False) on a hit, (None, leader's future, False) when
+        the same request is already grading, or (None, future, True) when the caller must grade it and
+        then call finish() or abort() with the future.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    RESULT_CACHE_LOOKUPS.inc(outcome="hit")
+                    return entry[1], None, False
+                del self._entries[key]
+
+            future = self._in_flight.get(key)
+            if future is not None:
+                RESULT_CACHE_LOOKUPS.inc(outcome="coalesced")
+                return None, future, False
+            RESULT_CACHE_LOOKUPS.inc(outcome="miss")
+            future = self._in_flight[key] = Future()
+            return None, future, True
+
+    def finish(self, key: Tuple, future: Future, response: Dict, cacheable: bool = True):
+        """The leader's result: stored when cacheable, handed to the waiters either way"""
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if cacheable:
+                self._entries[key] = (time.monotonic() + self.ttl, response)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        future.set_result(response)
+
+    def abort(self, key: Tuple, future: Future, error: BaseException):
+        """The leader failed (or its client went away, LeaderGone): waiters get the error"""
+        with self._lock:
+            self._in_flight.pop(key, None)
+        future.set_exception(error)
+
+    def get_or_compute(self, key: Tuple, compute: Callable[[], Dict],
+                       cacheable: Optional[Callable[[Dict], bool]] = None) -> Dict:
+        """compute() on a miss. Its result is stored unless cacheable(result) is False (waiters still get it)"""
+        response, future, leader = self.begin(key)
+        if response is not None:
+            return response
+        if not leader:
+            try:
+                return future.result()
+            except LeaderGone:
+                # the leader stopped without a result, grade it here instead
+                return self.get_or_compute(key, compute, cacheable)
+
+        try:
+            response = compute()
+        except BaseException as e:
+            self.abort(key, future, e)
+            raise
+        self.finish(key, future, response, cacheable is None or cacheable(response))
+        return response
+
+    def invalidate(self, question_ids: Iterable):
+        """Drop cached results of edited or removed questions (QuestionStore.on_change listener)"""
+        question_ids = set(question_ids)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in question_ids]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,184 @@
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from typing import List, Optional, Tuple
+
+# Hebrew ordinals as they appear as point markers in answers ("האחת, ...", "השנייה: ...").
+# Index in this list is the rank of the marker (0 = first point).
+ORDINALS = [
+    ["אחת", "אחד", "ראשונה", "ראשון"],
+    ["שנייה", "שניה", "שני"],
+    ["שלישית", "שלישי"],
+    ["רביעית", "רביעי"],
+    ["חמישית", "חמישי"],
+    ["שישית", "שישי"],
+    ["שביעית", "שביעי"],
+    ["שמינית", "שמיני"],
+    ["תשיעית", "תשיעי"],
+    ["עשירית", "עשירי"],
+]
+# "והאחרונה" closes the list, whatever its position
+LAST_ORDINAL = ["אחרונה", "אחרון"]
+
+_WORD_TO_RANK = {word: rank for rank, words in enumerate(ORDINALS) for word in words}
+_WORD_TO_RANK.update({word: -1 for word in LAST_ORDINAL})
+
+# optional ו/ב prefix, then the definite ה, then the ordinal, as a whole word.
+# Longer alternatives first so "שנייה" is not matched as "שני".
+_ORDINAL_PATTERN = re.compile(
+    r'(?<!\w)(?:ו|ב|וב)?ה(' + '|'.join(sorted(_WORD_TO_RANK, key=len, reverse=True)) + r')(?!\w)(\s*[,:\-–.])?'
+)
+# a short definite noun right before an ordinal: "התכונה השנייה", "והסיבה השלישית"
+_MARKER_NOUN = re.compile(r'(?<!\w)ו?ה\w{1,8}[ \t]+\Z')
+# what comes right before a marker (or its noun) that starts a line, list bullets allowed
+_LINE_START = re.compile(r'(?:^|\n)[ \t]*(?:[-•*][ \t]*)?\Z')
+# ... or a sentence
+_SENTENCE_START = re.compile(r'[.!?:;][ \t]*\Z')
+# how far back those are looked for, keeps the scan linear
+_LOOKBACK = 24
+# "1." / "2)" / "3 " at the start of a line
+_NUMBER_PATTERN = re.compile(r'^[ \t]*(\d{1,2})(?:[.)]|(?=\s))', re.MULTILINE)
+# list numbering or bullet left at the end of a part, e.g. "...סוף הנקודה.\n2.\t" or "...\n- "
+_TRAILING_NUMBER = re.compile(r'\s*\n[ \t]*(?:\d{1,2}[.)]?|[-•*])$')
+
+
+def _starts_clause(text: str, start: int) -> bool:
+    lo = max(0, start - _LOOKBACK)
+    return bool(_LINE_START.search(text, lo, start) or _SENTENCE_START.search(text, lo, start))
+
+
+def _point_start(text: str, m: "re.Match", strong: bool) -> Optional[int]:
+    """
+    Where the point of an ordinal marker starts, None when the ordinal is not a point marker.
+    A marker followed by punctuation ("האחת,") always is. Without punctuation only at the start
+    of a line, or after a short noun that starts a line or sentence ("התכונה השנייה היא"), not in
+    the middle of one ("הראשון לומר זאת היה משה. השני היה אהרון."). A noun starting the clause
+    belongs to the point, so the cut is made before it.
+    """
+    start = m.start()
+    noun = _MARKER_NOUN.search(text, max(0, start - _LOOKBACK), start)
+    if noun and _starts_clause(text, noun.start()):
+        return noun.start()
+    if strong or _LINE_START.search(text, max(0, start - _LOOKBACK), start):
+        return start
+    return None
+
+
+def _ordinal_markers(text: str, strong_only: bool = False) -> List[Tuple[int, int]]:
+    """
+    Find ordinal markers that form the sequence first, second, ... (optionally ending with "last").
+    Returns (point start offset, rank) for each marker in order, see _point_start.
+    strong_only keeps only markers followed by punctuation ("האחת,"); otherwise markers without
+    punctuation are taken too, where they start a line or follow a noun that starts a sentence.
+    """
+    markers = []
+    for m in _ORDINAL_PATTERN.finditer(text):
+        strong = m.group(2) is not None
+        if strong_only and not strong:
+            continue
+        rank = _WORD_TO_RANK[m.group(1)]
+        expected = len(markers)
+        if rank == expected or (rank == -1 and expected > 0):
+            start = _point_start(text, m, strong)
+            if start is None:
+                continue
+            markers.append((start, rank))
+            if rank == -1:
+                break
+    return markers
+
+
+def _number_markers(text: str) -> List[Tuple[int, int]]:
+    """Line-start list numbering 1, 2, 3 ... in order. A lone "1" is not a list."""
+    markers = []
+    for m in _NUMBER_PATTERN.finditer(text):
+        if int(m.group(1)) == len(markers) + 1:
+            markers.append((m.start(), len(markers)))
+    return markers if len(markers) > 1 else []
+
+
+def _cut(text: str, markers: List[Tuple[int, int]]) -> List[str]:
+    """Cut text at marker offsets, dropping whatever comes before the first marker"""
+    parts = []
+    for i, (start, _) in enumerate(markers):
+        end = markers[i + 1][0] if i + 1 < len(markers) else len(text)
+        parts.append(_TRAILING_NUMBER.sub('', text[start:end].strip()))
+    return parts
+
+
+def segment_ordinals(text: str, num_parts: int) -> Optional[List[str]]:
+    """
+    Deterministic split of an answer into points by its ordinal markers (האחת, השנייה, ... והאחרונה),
+    falling back to line-start numbering (1. 2. 3.).
+    Runs in linear time over the text.
+
+    Returns the list of points (each starting at its marker, preamble dropped) when the split
+    is confident: the number of markers found matches num_parts, or the text has no markers at all
+    and a single part is expected. Returns None when it can't decide, so the caller can use the LLM.
+    """
+    if not text or not text.strip():
+        return None
+
+    strategies = (
+        lambda: _ordinal_markers(text, strong_only=True),
+        lambda: _ordinal_markers(text),
+        lambda: _number_markers(text),
+    )
+    for find_markers in strategies:
+        markers = find_markers()
+        if len(markers) == num_parts:
+            parts = _cut(text, markers)
+            if all(parts):
+                return parts
+
+    if num_parts == 1 and not _ordinal_markers(text) and not _number_markers(text):
+        return [text.strip()]
+
+    return None
+
+
+_SENTENCE_END = re.compile(r'(?<=[.!?:;])\s+|\n+')
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Last-resort split when neither the markers nor the LLM could split an answer:
+    one part per sentence, so semantic matching can still find the points that are there.
+    """
+    return [sentence.strip() for sentence in _SENTENCE_END.split(text or "") if sentence.strip()]
+
+
+# a quoted segment may have this share of its words changed or missing (at least one from 4 words up)
+# and still count as found in the answer
+SEGMENT_MISSING_RATIO = 0.1
+_WORD = re.compile(r'\w+')
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(unicodedata.normalize('NFKC', text or "").casefold())
+
+
+def _quoted(segment_words: List[str], text_words: List[str]) -> bool:
+    n = len(segment_words)
+    if any(text_words[i:i + n] == segment_words for i in range(len(text_words) - n + 1)):
+        return True
+
+    blocks = [block for block in SequenceMatcher(None, segment_words, text_words, autojunk=False).get_matching_blocks()
+              if block.size]
+    missing = max(int(n * SEGMENT_MISSING_RATIO), 1 if n >= 4 else 0)
+    if not blocks or sum(block.size for block in blocks) < n - missing:
+        return False
+    span = blocks[-1].b + blocks[-1].size - blocks[0].b
+    return span <= n + max(2, n // 2)
+
+
+def segment_in_text(segment: str, text: str) -> bool:
+    """
+    Whether segment was taken from text: the words of each of its sentences appear in text in order,
+    ignoring case, punctuation and whitespace, with a few words changed or skipped (SEGMENT_MISSING_RATIO)
+    and within a span not much longer than the sentence itself.
+    """
+    text_words = _words(text)
+    sentences = [_words(sentence) for sentence in split_sentences(segment)]
+    sentences = [words for words in sentences if words]
+    return bool(sentences) and all(_quoted(words, text_words) for words in sentences)
@@ -0,0 +1,109 @@
+"""
+Production entry point: gunicorn with preforked workers.
+
+The Flask app (embedding model, question store, artifacts) is loaded once in the master
+process before the workers are forked, so the model weights are shared copy-on-write
+instead of being loaded again by every worker.
+
+usage:
+    python serve.py                                   # 2 workers x 8 gradings, port 5050
+    python serve.py --workers 4 --max-in-flight 6 --request-budget 45
+    python serve.py --no-preload                      # every worker loads its own model
+
+With gthread workers, gunicorn's --timeout is only a heartbeat: the worker's main loop keeps
+notifying the master while request threads run, so a slow request is never killed by it.
+The time limit of a grading is the latency budget of backend.py (REQUEST_BUDGET_SECONDS,
+BATCH_BUDGET_SECONDS, see backend_health.py): LLM calls that don't fit in it are skipped
+and the answer is graded without them.
+
+`python backend.py` is still the development server. gunicorn does not run on Windows.
+"""
+import argparse
+import os
+import threading
+
+from gunicorn.app.base import BaseApplication
+
+# spare threads per worker on top of MAX_IN_FLIGHT: requests over the limit still reach
+# Flask and get a quick 503 + Retry-After instead of waiting in gunicorn's queue
+SPARE_THREADS = 2
+
+
+def post_fork(server, worker):
+    import backend
+    import llm_client
+
+    # connections and executor threads of the master must not be shared with the worker
+    llm_client.reset_clients()
+    backend.grader.after_fork()
+    # the workers take queued jobs straight from jobs.db, including the ones the master recovered
+    backend.job_queue.start()
+    if os.environ.get("BACKGROUND_WARMUP") == "0":
+        # the master loaded the model before forking, artifacts are built by the workers
+        threading.Thread(target=backend.warmup_artifacts, name="warmup", daemon=True).start()
+    server.log.info(f"Worker {worker.pid} ready (preloaded model shared with master)")
+
+
+def worker_int(worker):
+    worker.log.info(f"Worker {worker.pid} interrupted, finishing in-flight gradings")
+
+
+class GradingServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from backend import app
+        return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the grading backend under gunicorn")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5050)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", 2)))
+    parser.add_argument("--max-in-flight", type=int, default=int(os.environ.get("MAX_IN_FLIGHT", 8)),
+                        help="gradings per worker at once, the rest get 503")
+    parser.add_argument("--request-budget", type=float, default=float(os.environ.get("REQUEST_BUDGET_SECONDS", 60)),
+                        help="seconds of LLM time per /process or /process/stream request, then it is graded without the LLM (0 = no limit)")
+    parser.add_argument("--batch-budget", type=float, default=float(os.environ.get("BATCH_BUDGET_SECONDS", 600)),
+                        help="the same for a whole /process/batch request (0 = no limit)")
+    parser.add_argument("--timeout", type=int, default=int(os.environ.get("WORKER_TIMEOUT", 120)),
+                        help="seconds without a heartbeat before a hung worker process is restarted; "
+                             "does not limit request time, see --request-budget")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.environ.get("GRACEFUL_TIMEOUT", 60)),
+                        help="seconds workers get to finish in-flight requests on shutdown/restart")
+    parser.add_argument("--no-preload", action="store_true", help="load the app in each worker instead of the master")
+    args = parser.parse_args(argv)
+
+    # read by backend.py when it is imported below
+    os.environ["MAX_IN_FLIGHT"] = str(args.max_in_flight)
+    os.environ["REQUEST_BUDGET_SECONDS"] = str(args.request_budget)
+    os.environ["BATCH_BUDGET_SECONDS"] = str(args.batch_budget)
+    if not args.no_preload:
+        # load the model in the master before forking, not in a thread that would race the fork
+        os.environ["BACKGROUND_WARMUP"] = "0"
+
+    options = {
+        "bind": f"{args.host}:{args.port}",
+        "workers": args.workers,
+        "worker_class": "gthread",
+        "threads": args.max_in_flight + SPARE_THREADS,
+        "timeout": args.timeout,
+        "graceful_timeout": args.graceful_timeout,
+        "keepalive": 5,
+        "preload_app": not args.no_preload,
+        "post_fork": post_fork,
+        "worker_int": worker_int,
+    }
+    print(f"Starting gunicorn on http://{options['bind']}: {args.workers} workers x {args.max_in_flight} gradings")
+    GradingServer(options).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -187,33 +187,62 @@ $currentQuestion = $_SESSION['current_question'];
                 `);
                 $("#responseArea").removeClass("alert-danger").addClass("alert-info").show();
                 
-                // Send data to backend
-                $.ajax({
-                    url: "http://localhost:5050/process",
-                    type: "POST",
-                    contentType: "application/json",
-                    data: JSON.stringify({
+                // Send data to backend. The score arrives first, then the feedback is streamed in as it is generated.
+                fetch("http://localhost:5050/process/stream", {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify({
                         text: answerText,
                         question_id: questionId
-                    }),
-                    success: function(response) {
-                        // Display response
-                        $("#responseContent").html(response.feedback);
-                        
-                        // Check score and apply appropriate styling
-                        if (response.total_score === 0) {
-                            $("#responseContent").prepend("<div class='alert alert-danger'><strong>The answer is not fulfilling the requirements.</strong></div>");
-                            $("#responseArea").removeClass("alert-success alert-info").addClass("alert-danger");
-                        } else if (response.feedback && response.feedback.toLowerCase().includes("full answer")) {
-                            $("#responseArea").removeClass("alert-danger alert-info").addClass("alert-success");
-                        } else {
-                            $("#responseArea").removeClass("alert-danger").addClass("alert-info");
+                    })
+                }).then(async function(res) {
+                    if (!res.ok) {
+                        const body = await res.json().catch(() => ({}));
+                        throw new Error(body.response || res.statusText);
+                    }
+
+                    const reader = res.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = "";
+                    let feedbackEl = null;
+
+                    const handle = function(msg) {
+                        if (msg.type === "score") {
+                            $("#responseContent").empty();
+                            // Check score and apply appropriate styling
+                            if (msg.score === 0) {
+                                $("#responseContent").append("<div class='alert alert-danger'><strong>The answer is not fulfilling the requirements.</strong></div>");
+                                $("#responseArea").removeClass("alert-success alert-info").addClass("alert-danger");
+                            } else if (msg.score === msg.max_score) {
+                                $("#responseArea").removeClass("alert-danger alert-info").addClass("alert-success");
+                            } else {
+                                $("#responseArea").removeClass("alert-danger").addClass("alert-info");
+                            }
+                            feedbackEl = $("<div></div>").appendTo("#responseContent");
+                        } else if (msg.type === "feedback") {
+                            feedbackEl.text(feedbackEl.text() + msg.token);
+                        } else if (msg.type === "done") {
+                            feedbackEl.text(msg.feedback);
+                        } else if (msg.type === "error") {
+                            throw new Error(msg.response);
+                        }
+                    };
+
+                    while (true) {
+                        const { value, done } = await reader.read();
+                        if (done) break;
+                        buffer += decoder.decode(value, { stream: true });
+                        // one JSON object per line
+                        let newline;
+                        while ((newline = buffer.indexOf("\n")) >= 0) {
+                            const line = buffer.slice(0, newline).trim();
+                            buffer = buffer.slice(newline + 1);
+                            if (line) handle(JSON.parse(line));
                         }
-                    },
-                    error: function(xhr, status, error) {
-                        $("#responseContent").html("Error: " + error);
-                        $("#responseArea").removeClass("alert-info").addClass("alert-danger");
                     }
+                }).catch(function(error) {
+                    $("#responseContent").text("Error: " + error.message);
+                    $("#responseArea").removeClass("alert-info alert-success").addClass("alert-danger");
                 });
             });
         });